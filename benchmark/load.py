@@ -0,0 +1,246 @@
+"""Load generator and latency benchmark for the call_backend route.
+
+    python -m benchmark.load --stand-in --concurrency 50 --rate 200 --duration 30 \\
+        --mix ok=90,server_error=10 --output result.json
+
+Requests are sent open-loop at --rate (or closed-loop when --rate is 0) with at
+most --concurrency in flight. Samples taken during --warmup are discarded.
+The circuit status route is polled in the background to record breaker state
+transitions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLIENT_PORT = 7071
+CIRCUIT_PORT = 7072
+BACKEND_PORT = 7073
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(','):
+        status, weight = item.split('=')
+        mix[status.strip()] = float(weight)
+    return mix
+
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    # Nearest-rank percentile.
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return round(ordered[rank - 1], 3)
+
+
+def summarize(latencies: List[float]) -> dict:
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': round(max(latencies), 3) if latencies else None
+    }
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.measuring = False
+        self.latencies: List[float] = []
+        self.by_mix: Dict[str, List[float]] = {}
+        self.responses: Dict[int, int] = {}
+        self.errors = 0
+
+    def record(self, status: str, http_status: Optional[int], latency_ms: float) -> None:
+        if not self.measuring:
+            return
+        if http_status is None:
+            self.errors += 1
+            return
+        self.latencies.append(latency_ms)
+        self.by_mix.setdefault(status, []).append(latency_ms)
+        self.responses[http_status] = self.responses.get(http_status, 0) + 1
+
+
+async def send(session: aiohttp.ClientSession, url: str, entity_key: str, status: str, recorder: Recorder) -> None:
+    params = {'entity_key': entity_key, 'status': status}
+    started = time.perf_counter()
+    try:
+        async with session.get(url, params=params) as response:
+            await response.read()
+            http_status = response.status
+    except Exception as e:
+        logger.debug(f'Request failed {e}')
+        http_status = None
+    recorder.record(status, http_status, (time.perf_counter() - started) * 1000)
+
+
+async def watch_transitions(session: aiohttp.ClientSession, url: str, entity_key: str, started: float, transitions: List[dict]) -> None:
+    previous = None
+    while True:
+        try:
+            async with session.get(url, params={'entity_key': entity_key}) as response:
+                state = await response.json()
+            if state['status'] != previous:
+                transitions.append({
+                    'at_seconds': round(time.perf_counter() - started, 3),
+                    'from': previous,
+                    'to': state['status']
+                })
+                previous = state['status']
+        except Exception as e:
+            logger.debug(f'Failed to read circuit status {e}')
+        await asyncio.sleep(0.2)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    mix = parse_mix(args.mix)
+    statuses, weights = list(mix), list(mix.values())
+    recorder = Recorder()
+    transitions: List[dict] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        watcher = asyncio.ensure_future(
+            watch_transitions(session, args.status_url, args.entity_key, started, transitions))
+
+        async def one() -> None:
+            try:
+                await send(session, args.url, args.entity_key, random.choices(statuses, weights)[0], recorder)
+            finally:
+                semaphore.release()
+
+        end = started + args.warmup + args.duration
+        measure_from = started + args.warmup
+        pending = set()
+        sent = 0
+        while time.perf_counter() < end:
+            if not recorder.measuring and time.perf_counter() >= measure_from:
+                recorder.measuring = True
+            await semaphore.acquire()
+            task = asyncio.ensure_future(one())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            sent += 1
+            if args.rate > 0:
+                # Open loop: keep the schedule even when responses are slow.
+                next_at = started + sent / args.rate
+                await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+
+        if pending:
+            await asyncio.wait(pending)
+        elapsed = time.perf_counter() - measure_from
+        watcher.cancel()
+
+    return {
+        'config': {
+            'url': args.url,
+            'entity_key': args.entity_key,
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'mix': mix
+        },
+        'throughput_rps': round(len(recorder.latencies) / elapsed, 2) if elapsed > 0 else None,
+        'latency': summarize(recorder.latencies),
+        'latency_by_status': {status: summarize(v) for status, v in recorder.by_mix.items()},
+        'responses': recorder.responses,
+        'errors': recorder.errors,
+        'transitions': transitions
+    }
+
+
+def wait_for_port(port: int, timeout: float = 15) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Stand-in server did not listen on {port}')
+
+
+def start_stand_ins(args: argparse.Namespace) -> List[subprocess.Popen]:
+    durable_url = f'http://127.0.0.1:{CIRCUIT_PORT}/api'
+    env = dict(
+        os.environ,
+        BACKEND_URL=f'http://127.0.0.1:{BACKEND_PORT}/api/answer',
+        CIRCUIT_URL=f'{durable_url}/circuit_status',
+        FAILURE_URL=f'{durable_url}/orchestrators/count_failure',
+        SUCCESS_URL=f'{durable_url}/orchestrators/count_success',
+        PROBE_URL=f'{durable_url}/orchestrators/acquire_probe_orchestrator',
+        BATCH_FAILURE_URL=f'{durable_url}/orchestrators/count_failures',
+        BATCH_SUCCESS_URL=f'{durable_url}/orchestrators/count_successes',
+        STATE_CHANGE_WEBHOOK_URL=f'http://127.0.0.1:{CLIENT_PORT}/api/circuit_events'
+    )
+    servers = [
+        (['benchmark.stand_in', 'backend', '--latency-ms', str(args.backend_latency_ms)], BACKEND_PORT),
+        (['emulator.server', '--operation-latency-ms', str(args.operation_latency_ms)], CIRCUIT_PORT),
+        (['benchmark.stand_in', 'client'], CLIENT_PORT)
+    ]
+    processes = []
+    for module, port in servers:
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m'] + module + ['--port', str(port)],
+            cwd=ROOT,
+            env=env
+        ))
+    for _, port in servers:
+        wait_for_port(port)
+    return processes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the call_backend route.')
+    parser.add_argument('--url', default=f'http://localhost:{CLIENT_PORT}/api/call_backend')
+    parser.add_argument('--status-url', default=f'http://localhost:{CIRCUIT_PORT}/api/circuit_status')
+    parser.add_argument('--entity-key', default='debugentity')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=0, help='requests per second, 0 for closed loop')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds discarded before measuring')
+    parser.add_argument('--mix', default='ok=100', help='weights per status, e.g. ok=90,server_error=10')
+    parser.add_argument('--stand-in', action='store_true', help='start local stand-in servers')
+    parser.add_argument('--backend-latency-ms', type=float, default=0)
+    parser.add_argument('--operation-latency-ms', type=float, default=0, help='emulated entity operation latency')
+    parser.add_argument('--output', help='write the JSON report to this path')
+    args = parser.parse_args()
+
+    processes = start_stand_ins(args) if args.stand_in else []
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    logger.info(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""Replay traffic through the circuit breaker state machine on a virtual clock.
+
+    python -m benchmark.simulate --scenario burst --duration 3600 --rate 20 \\
+        --set THREASHOLD_COUNTS=10 --sweep OPEN_DURATION_MINUTES=1,3,5 --output sim.json
+    python -m benchmark.simulate --trace traffic.jsonl
+
+circuit_breaker_actor runs in process with a VirtualClock installed in the
+circuit_breaker app's shared.clock, so an hour of traffic replays in seconds
+and a run is deterministic for a given --seed. The client side follows
+call_backend: a Closed circuit calls the backend, a HalfOpen one only with a
+probe permit, and an Open one rejects the request. Failures are reported as
+count_failure, and successes as count_success when they hold a permit or
+--report-calls is set. State changes reach the client at once, as with
+circuit_events. Like circuit_transition_orchestrator, a timer moves an Open
+circuit to HalfOpen at open_until.
+
+Synthetic traffic arrives at --rate requests per second. The backend fails
+--error-rate of the requests while it is failing and --base-error-rate
+otherwise. burst fails once for --failure-seconds from --failure-start.
+flapping alternates --failure-seconds of failing and healthy from there on.
+A trace holds JSON lines of {"t": seconds from start, "ok": bool,
+"duration_ms": n} and is replayed as recorded.
+
+Each run reports the state changes and, for synthetic traffic, how long the
+circuit took to open after the backend started failing and to close after it
+recovered. --sweep repeats the run for every value of one setting, so
+thresholds can be compared offline.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from emulator.durable import EntityContext
+from emulator.server import CIRCUIT_BREAKER_DIR
+
+# Imported the way the Functions host imports them from circuit_breaker.
+sys.path.insert(0, CIRCUIT_BREAKER_DIR)
+import circuit_breaker_actor  # noqa: E402
+from shared import clock, events  # noqa: E402
+from shared.state import parse_time  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
+
+# Virtual time starts here, so windows and open_until look like real epochs.
+START_EPOCH = 1700000000
+
+
+class Request(NamedTuple):
+    t: float
+    ok: bool
+    duration_ms: float
+
+
+def failing_periods(args: argparse.Namespace) -> List[Tuple[float, float]]:
+    """(start, end) seconds of the synthetic scenario during which the backend fails."""
+    if args.scenario == 'burst':
+        return [(args.failure_start, args.failure_start + args.failure_seconds)]
+    periods = []
+    start = args.failure_start
+    while start < args.duration:
+        periods.append((start, min(start + args.failure_seconds, args.duration)))
+        start += 2 * args.failure_seconds
+    return periods
+
+
+def synthetic_traffic(args: argparse.Namespace, periods: List[Tuple[float, float]]) -> Iterator[Request]:
+    rng = random.Random(args.seed)
+    t = rng.expovariate(args.rate)
+    while t < args.duration:
+        failing = any(start <= t < end for start, end in periods)
+        error_rate = args.error_rate if failing else args.base_error_rate
+        latency_ms = args.failing_latency_ms if failing and args.failing_latency_ms is not None else args.latency_ms
+        yield Request(t, rng.random() >= error_rate, latency_ms)
+        t += rng.expovariate(args.rate)
+
+
+def recorded_traffic(path: str) -> List[Request]:
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                requests.append(Request(float(record['t']), bool(record.get('ok', True)), float(record.get('duration_ms', 0))))
+    return sorted(requests)
+
+
+class SimulatedCircuit:
+    """One circuit_breaker_actor entity driven operation by operation, with its state kept as JSON."""
+
+    def __init__(self, entity_key: str, virtual_clock: clock.VirtualClock) -> None:
+        self.entity_key = entity_key
+        self.clock = virtual_clock
+        self.status = 'Closed'
+        self.state: Optional[str] = None
+        self.timer_at: Optional[int] = None
+        self.operations = 0
+
+    def call(self, operation_name: str, operation_input: Optional[dict] = None) -> dict:
+        context = EntityContext('circuit_breaker_actor', self.entity_key, operation_name, self.state, operation_input)
+        circuit_breaker_actor.entity_function(context)
+        self.state = context._state
+        self.operations += 1
+        result = context._result
+        self.status = result['status']
+        if result.get('open_until') is not None:
+            self.timer_at = parse_time(result['open_until'])
+        return result
+
+    def fire_timer(self, epoch: float) -> None:
+        if self.timer_at is not None and epoch >= self.timer_at:
+            self.clock.advance_to(self.timer_at)
+            self.timer_at = None
+            self.call('get')
+
+
+def simulate(requests: Iterator[Request], entity_key: str, args: argparse.Namespace) -> dict:
+    virtual_clock = clock.VirtualClock(START_EPOCH)
+    previous_clock = clock.install(virtual_clock)
+    circuit = SimulatedCircuit(entity_key, virtual_clock)
+    transitions = []
+
+    def on_change(event: dict) -> None:
+        if event['entity_key'] == entity_key:
+            transitions.append({
+                't': round(virtual_clock.now() - START_EPOCH, 3),
+                'from': event['previous_status'],
+                'to': event['status']
+            })
+
+    events.subscribe(on_change)
+    counts = {'requests': 0, 'allowed': 0, 'rejected': 0, 'failed': 0, 'probes': 0}
+    last_t = 0.0
+    try:
+        for request in requests:
+            counts['requests'] += 1
+            last_t = request.t
+            epoch = START_EPOCH + request.t
+            circuit.fire_timer(epoch)
+            virtual_clock.advance_to(epoch)
+
+            lease_id = None
+            if circuit.status == 'HalfOpen':
+                permit = circuit.call('acquire_probe')
+                if permit['granted']:
+                    lease_id = permit['lease_id']
+            if circuit.status == 'Open' or (circuit.status == 'HalfOpen' and lease_id is None):
+                counts['rejected'] += 1
+                continue
+
+            counts['allowed'] += 1
+            report = {'duration_ms': request.duration_ms}
+            if lease_id is not None:
+                counts['probes'] += 1
+                report['lease_id'] = lease_id
+            if not request.ok:
+                counts['failed'] += 1
+                circuit.call('count_failure', report)
+            elif lease_id is not None or args.report_calls:
+                circuit.call('count_success', report)
+        # Let a pending HalfOpen transition happen within the simulated span.
+        circuit.fire_timer(START_EPOCH + last_t)
+    finally:
+        events.unsubscribe(on_change)
+        clock.install(previous_clock)
+
+    return dict(counts, entity_operations=circuit.operations, simulated_seconds=round(last_t, 3), transitions=transitions)
+
+
+def incident_timings(transitions: List[dict], periods: List[Tuple[float, float]]) -> dict:
+    """Seconds from each failing period's start to Open and from its end to Closed."""
+    incidents = []
+    for index, (start, end) in enumerate(periods):
+        next_start = periods[index + 1][0] if index + 1 < len(periods) else float('inf')
+        opened = next((change['t'] for change in transitions if change['to'] == 'Open' and start <= change['t'] < end), None)
+        closed = next((change['t'] for change in transitions if change['to'] == 'Closed' and end <= change['t'] < next_start), None)
+        incidents.append({
+            'start': start,
+            'end': end,
+            'detection_seconds': round(opened - start, 3) if opened is not None else None,
+            'recovery_seconds': round(closed - end, 3) if closed is not None and opened is not None else None
+        })
+    trips = [change['t'] for change in transitions if change['to'] == 'Open' and change['from'] == 'Closed']
+    detections = [incident['detection_seconds'] for incident in incidents if incident['detection_seconds'] is not None]
+    recoveries = [incident['recovery_seconds'] for incident in incidents if incident['recovery_seconds'] is not None]
+    return {
+        'incidents': incidents,
+        'missed_incidents': len(incidents) - len(detections),
+        'false_trips': sum(1 for t in trips if not any(start <= t < end for start, end in periods)),
+        'mean_detection_seconds': round(sum(detections) / len(detections), 3) if detections else None,
+        'mean_recovery_seconds': round(sum(recoveries) / len(recoveries), 3) if recoveries else None
+    }
+
+
+def run_once(args: argparse.Namespace, settings: dict, run_index: int) -> dict:
+    previous = {name: os.environ.get(name) for name in settings}
+    os.environ.update(settings)
+    try:
+        periods = [] if args.trace else failing_periods(args)
+        requests = recorded_traffic(args.trace) if args.trace else synthetic_traffic(args, periods)
+        started = time.perf_counter()
+        result = simulate(requests, f'simulation{run_index}', args)
+        wall_seconds = time.perf_counter() - started
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    result = dict({'settings': settings}, **result)
+    if not args.trace:
+        result.update(incident_timings(result['transitions'], periods))
+    result['wall_seconds'] = round(wall_seconds, 3)
+    result['speedup'] = round(result['simulated_seconds'] / wall_seconds) if wall_seconds > 0 else None
+    return result
+
+
+def parse_setting(value: str) -> Tuple[str, str]:
+    name, separator, setting = value.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f'expected NAME=VALUE, got {value}')
+    return name, setting
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay traffic through the circuit breaker on a virtual clock.')
+    parser.add_argument('--scenario', choices=['burst', 'flapping'], default='burst', help='synthetic traffic shape')
+    parser.add_argument('--trace', help='JSON lines of recorded requests to replay instead of synthetic traffic')
+    parser.add_argument('--duration', type=float, default=3600, help='simulated seconds of synthetic traffic')
+    parser.add_argument('--rate', type=float, default=20, help='requests per second')
+    parser.add_argument('--failure-start', type=float, default=600, help='second the backend starts failing')
+    parser.add_argument('--failure-seconds', type=float, default=300, help='length of a failing period')
+    parser.add_argument('--error-rate', type=float, default=1.0, help='share of failing requests while failing')
+    parser.add_argument('--base-error-rate', type=float, default=0.0, help='share of failing requests while healthy')
+    parser.add_argument('--latency-ms', type=float, default=50, help='backend latency while healthy')
+    parser.add_argument('--failing-latency-ms', type=float, help='backend latency while failing, --latency-ms by default')
+    parser.add_argument('--report-calls', action='store_true', help='report every success like REPORT_CALLS=true')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic traffic')
+    parser.add_argument('--set', type=parse_setting, action='append', default=[], metavar='NAME=VALUE',
+                        help='circuit_breaker setting for every run, such as THREASHOLD_COUNTS=10')
+    parser.add_argument('--sweep', type=parse_setting, metavar='NAME=V1,V2,...',
+                        help='run once per value of one setting')
+    parser.add_argument('--output', help='write the JSON report to this path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    settings = dict(args.set)
+    runs = [settings]
+    if args.sweep is not None:
+        name, values = args.sweep
+        runs = [dict(settings, **{name: value}) for value in values.split(',')]
+
+    results = []
+    for index, run_settings in enumerate(runs):
+        result = run_once(args, run_settings, index)
+        logger.info(json.dumps({name: value for name, value in result.items() if name not in ('transitions', 'incidents')}))
+        results.append(result)
+
+    if args.output:
+        report = {
+            'config': {name: value for name, value in vars(args).items() if name not in ('set', 'sweep', 'output')},
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
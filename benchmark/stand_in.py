@@ -0,0 +1,106 @@
+"""Local stand-in servers so the benchmark runs without Azure.
+
+    python -m benchmark.stand_in backend --port 7073
+    python -m benchmark.stand_in client --port 7071
+
+backend serves the same statuses as backend/answer. client runs the real
+HTTP functions of the client app, such as call_backend, behind aiohttp. The circuit_breaker app is
+served by the emulator package.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+
+from aiohttp import web
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_DIR = os.path.join(ROOT, 'client')
+
+
+def backend_app(latency_ms: float = 0) -> web.Application:
+    async def answer(request: web.Request) -> web.Response:
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        status = request.query.get('status')
+        if status == 'ok':
+            return web.Response(status=200, text='Hello, This HTTP triggered function executed successfully.')
+        elif status == 'server_error':
+            return web.Response(status=500, text='This HTTP triggered function had internal server error.')
+        elif status == 'client_error':
+            return web.Response(status=400, text='This HTTP triggered function had Client error.')
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_get('/api/answer', answer)
+    return app
+
+
+def client_app() -> web.Application:
+    sys.path.insert(0, CLIENT_DIR)
+    import azure.functions as func
+
+    def handler(function_main):
+        async def handle(request: web.Request) -> web.Response:
+            req = func.HttpRequest(
+                method=request.method,
+                url=str(request.url),
+                headers=dict(request.headers),
+                params=dict(request.query),
+                body=await request.read()
+            )
+            resp = await function_main(req)
+            headers = dict(resp.headers)
+            if not any(name.lower() == 'content-type' for name in headers):
+                headers['Content-Type'] = resp.mimetype
+            return web.Response(
+                status=resp.status_code,
+                body=resp.get_body(),
+                headers=headers
+            )
+        return handle
+
+    app = web.Application()
+    # Serve every HTTP triggered function of the client app like the Functions host.
+    for name in sorted(os.listdir(CLIENT_DIR)):
+        path = os.path.join(CLIENT_DIR, name, 'function.json')
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            bindings = json.load(f)['bindings']
+        trigger = next((b for b in bindings if b['type'] == 'httpTrigger'), None)
+        if trigger is None:
+            continue
+        function_main = importlib.import_module(name).main
+        for method in trigger.get('methods', ['get', 'post']):
+            app.router.add_route(method.upper(), f'/api/{trigger.get("route", name)}', handler(function_main))
+
+    from shared.session import close_session
+
+    async def close(app: web.Application) -> None:
+        await close_session()
+
+    app.on_cleanup.append(close)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run a local stand-in server.')
+    parser.add_argument('app', choices=['backend', 'client'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--latency-ms', type=float, default=0, help='backend latency per request')
+    args = parser.parse_args()
+
+    if args.app == 'backend':
+        app = backend_app(args.latency_ms)
+    else:
+        app = client_app()
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Serialized size and (de)serialization time of circuit_breaker_actor state.
+
+    python -m benchmark.state --iterations 20000 --output state.json
+
+Compares the version 1 dict, with '%Y-%m-%dT%H:%M:%S' strings and one
+self-describing dict per window, against the version 2 payload written by
+CircuitState.dump(). Each entity operation reads its state from JSON and
+writes it back, so one round trip is measured as JSON decoding, loading,
+dumping and JSON encoding, the way the task hub and the entity do it.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import timeit
+from datetime import datetime
+from typing import Callable, List
+
+from emulator.server import CIRCUIT_BREAKER_DIR
+
+# Imported the way the Functions host imports them from circuit_breaker.
+sys.path.insert(0, CIRCUIT_BREAKER_DIR)
+from shared.state import CircuitState, format_epoch, parse_time  # noqa: E402
+from shared.window import FailureWindow, to_epoch  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
+
+TIMESPAN_SECONDS = 30
+WINDOW_BUCKETS = 10
+V1_WINDOW_FIELDS = ('failure_window', 'call_window', 'slow_window')
+
+
+def to_v1(state: CircuitState) -> dict:
+    """The dict circuit_breaker_actor stored before schema version 2."""
+    return dict(
+        {
+            'status': state.status,
+            'open_until': format_epoch(state.open_until),
+            'success_count': state.success_count,
+            'probe_leases': state.probe_leases
+        },
+        **{field: _v1_window(window) for field, window in zip(V1_WINDOW_FIELDS, state.windows)}
+    )
+
+
+def _v1_window(window: FailureWindow) -> dict:
+    return {
+        'bucket_seconds': window.bucket_seconds,
+        'head': window.head,
+        'counts': window.counts
+    }
+
+
+def v1_round_trip(text: str) -> str:
+    """What an operation of the version 1 entity did with its state."""
+    values = json.loads(text)
+    windows = []
+    for field in V1_WINDOW_FIELDS:
+        window = FailureWindow(TIMESPAN_SECONDS, WINDOW_BUCKETS)
+        stored = values.get(field)
+        if stored is not None:
+            window.restore(stored['bucket_seconds'], stored['head'], stored['counts'])
+        windows.append(window)
+    open_until = parse_time(values['open_until'])
+    new_values = {
+        'status': values['status'],
+        'open_until': format_epoch(open_until),
+        'success_count': values['success_count'],
+        'probe_leases': values['probe_leases']
+    }
+    for field, window in zip(V1_WINDOW_FIELDS, windows):
+        new_values[field] = _v1_window(window)
+    return json.dumps(new_values)
+
+
+def v2_round_trip(text: str, epoch: int) -> str:
+    return json.dumps(CircuitState.load(json.loads(text), TIMESPAN_SECONDS, WINDOW_BUCKETS).dump(epoch))
+
+
+def scenarios(epoch: int) -> dict:
+    new = CircuitState(TIMESPAN_SECONDS, WINDOW_BUCKETS)
+
+    closed = CircuitState(TIMESPAN_SECONDS, WINDOW_BUCKETS)
+    for offset in range(0, TIMESPAN_SECONDS, 2):
+        closed.failure_window.add(epoch - offset, 3)
+        closed.call_window.add(epoch - offset, 40)
+        closed.slow_window.add(epoch - offset, 2)
+
+    opened = CircuitState(TIMESPAN_SECONDS, WINDOW_BUCKETS)
+    for offset in range(0, TIMESPAN_SECONDS, 2):
+        opened.failure_window.add(epoch - offset, 10)
+        opened.call_window.add(epoch - offset, 10)
+    opened.status = 'Open'
+    opened.open_until = epoch + 180
+
+    half_open = CircuitState(TIMESPAN_SECONDS, WINDOW_BUCKETS)
+    half_open.status = 'HalfOpen'
+    half_open.success_count = 2
+    half_open.probe_leases = {'0' * 32: epoch + 30}
+
+    return {
+        'new': new,
+        'closed_busy': closed,
+        'open': opened,
+        'half_open': half_open
+    }
+
+
+def per_operation_us(operation: Callable[[], str], iterations: int) -> float:
+    # Best of three, to keep other work on the machine out of the number.
+    return min(timeit.repeat(operation, number=iterations, repeat=3)) / iterations * 1e6
+
+
+def run(args: argparse.Namespace) -> List[dict]:
+    epoch = to_epoch(datetime.utcnow())
+    results = []
+    for name, state in scenarios(epoch).items():
+        v1_text = json.dumps(to_v1(state))
+        v2_text = json.dumps(state.dump(epoch))
+        result = {
+            'scenario': name,
+            'v1_bytes': len(v1_text.encode('utf-8')),
+            'v2_bytes': len(v2_text.encode('utf-8')),
+            'v1_round_trip_us': round(per_operation_us(lambda: v1_round_trip(v1_text), args.iterations), 2),
+            'v2_round_trip_us': round(per_operation_us(lambda: v2_round_trip(v2_text, epoch), args.iterations), 2),
+            'migrate_us': round(per_operation_us(lambda: v2_round_trip(v1_text, epoch), args.iterations), 2)
+        }
+        logger.info(json.dumps(result))
+        results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the size and (de)serialization time of circuit state.')
+    parser.add_argument('--iterations', type=int, default=20000, help='round trips per measurement')
+    parser.add_argument('--output', help='write the JSON report to this path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    report = {
+        'config': {
+            'timespan_seconds': TIMESPAN_SECONDS,
+            'window_buckets': WINDOW_BUCKETS,
+            'iterations': args.iterations
+        },
+        'results': run(args)
+    }
+    logger.info(f'Finished in {time.perf_counter() - started:.1f} seconds')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
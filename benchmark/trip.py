@@ -0,0 +1,121 @@
+"""Trip latency of the circuit under a failure storm, with and without sharding.
+
+    python -m benchmark.trip --shards 1,4,8 --rate 2000 --threshold 100 \\
+        --operation-latency-ms 2 --output trip.json
+
+The circuit_breaker app runs in process on the emulator runtime, and failures
+are sent through orchestration_trigger like the client's count_failure
+reports. Trip latency is measured from the first failure sent to the Open
+state change published by circuit_breaker_actor, and orchestrations counts
+the instances started on the way. Each entity operation costs
+--operation-latency-ms and operations of one entity are serial, so a single
+entity builds a queue once failures arrive faster than it can process them.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+
+import azure.functions as func
+from aiohttp import web
+
+from emulator.durable import DurableRuntime, OrchestrationClient
+from emulator.server import CIRCUIT_BREAKER_DIR, load_function_app
+
+
+logger = logging.getLogger(__name__)
+
+
+async def trip_once(shards: int, args: argparse.Namespace) -> dict:
+    os.environ['CIRCUIT_SHARDS'] = str(shards)
+    os.environ['THREASHOLD_COUNTS'] = str(args.threshold)
+
+    runtime = DurableRuntime('http://127.0.0.1', args.operation_latency_ms)
+    load_function_app(CIRCUIT_BREAKER_DIR, runtime, web.Application())
+    client = OrchestrationClient(runtime)
+    trigger = importlib.import_module('orchestration_trigger')
+    events = importlib.import_module('shared.events')
+
+    entity_key = f'trip{shards}'
+    tripped = asyncio.get_event_loop().create_future()
+
+    def on_change(event: dict) -> None:
+        if event['entity_key'] == entity_key and event['status'] == 'Open' and not tripped.done():
+            tripped.set_result(time.perf_counter())
+
+    events.subscribe(on_change)
+    sent = 0
+    started = time.perf_counter()
+    trip_at: Optional[float] = None
+    try:
+        while time.perf_counter() - started < args.timeout:
+            req = func.HttpRequest(
+                method='GET',
+                url='/api/orchestrators/count_failure',
+                body=b'',
+                params={'entity_key': entity_key},
+                route_params={'functionName': 'count_failure'}
+            )
+            await trigger.run(req, client)
+            sent += 1
+            if tripped.done():
+                break
+            next_at = started + sent / args.rate
+            await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+        try:
+            trip_at = await asyncio.wait_for(asyncio.shield(tripped), max(args.timeout - (time.perf_counter() - started), 0))
+        except asyncio.TimeoutError:
+            trip_at = None
+    finally:
+        events.unsubscribe(on_change)
+
+    return {
+        'shards': shards,
+        'trip_latency_ms': round((trip_at - started) * 1000, 3) if trip_at is not None else None,
+        'failures_sent': sent,
+        'orchestrations': len(runtime.instances),
+        'ideal_trip_ms': round(args.threshold / args.rate * 1000, 3)
+    }
+
+
+async def run(args: argparse.Namespace) -> List[dict]:
+    results = []
+    for shards in [int(value) for value in args.shards.split(',')]:
+        result = await trip_once(shards, args)
+        logger.info(json.dumps(result))
+        results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure circuit trip latency with and without sharding.')
+    parser.add_argument('--shards', default='1,4,8', help='comma separated shard counts, 1 disables sharding')
+    parser.add_argument('--rate', type=float, default=2000, help='failures per second')
+    parser.add_argument('--threshold', type=int, default=100, help='THREASHOLD_COUNTS of the circuit')
+    parser.add_argument('--operation-latency-ms', type=float, default=2, help='emulated entity operation latency')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for the circuit to open')
+    parser.add_argument('--output', help='write the JSON report to this path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    report = {
+        'config': {
+            'rate': args.rate,
+            'threshold': args.threshold,
+            'operation_latency_ms': args.operation_latency_ms
+        },
+        'results': asyncio.run(run(args))
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import azure.durable_functions as df
+
+
+def orchestrator_function(context: df.DurableOrchestrationContext):
+    params = context.get_input()
+    entityId = df.EntityId("circuit_breaker_actor", params['entity_key'])
+    # {"granted": bool, "lease_id": str or None, "status": str}
+    permit = yield context.call_entity(entityId, "acquire_probe")
+    return permit
+
+main = df.Orchestrator.create(orchestrator_function)
@@ -1,117 +1,153 @@
 import logging
 import os
-from datetime import datetime, timedelta
+import time
+from typing import Optional
+from uuid import uuid4
 import azure.durable_functions as df
 
+from shared import clock, events, metrics
+from shared.rules import TripRule
+from shared.state import CircuitState
+from shared.window import to_epoch
+
+
+def release_probes(probe_leases: dict, report: Optional[dict]) -> None:
+    """Return the probe permits whose lease ids are attached to an outcome report."""
+    if report:
+        for lease_id in report.get('lease_ids', []) + [report.get('lease_id')]:
+            probe_leases.pop(lease_id, None)
+
+
 def entity_function(context: df.DurableEntityContext):
     """A Counter Durable Entity."""
 
-    d = {
-        "status": "Closed",
-        "failure_count": [],
-        "open_until": None,
-        "success_count": 0
-    }
-
-    THREASHOLD_COUNTS = int(os.environ.get('THREASHOLD_COUNTS', 10))
-    TIMESPAN_SECONDS = int(os.environ.get('TIMESPAN_SECONDS_SECONDS', 30))
+    started = time.perf_counter()
+    TIMESPAN_SECONDS = int(os.environ.get('TIMESPAN_SECONDS', 30))
+    WINDOW_BUCKETS = int(os.environ.get('WINDOW_BUCKETS', 10))
     OPEN_DURATION_MINUTES = int(os.environ.get('OPEN_DURATION_MINUTES', 3))
     SUCCESS_COUNTS = int(os.environ.get('SUCCESS_COUNTS', 5))
+    PROBE_PERMITS = int(os.environ.get('PROBE_PERMITS', 1))
+    PROBE_LEASE_SECONDS = int(os.environ.get('PROBE_LEASE_SECONDS', 30))
+    rule = TripRule.from_env()
 
-    logging.info(
-        f'Set THREASHOLD_COUNTS is {THREASHOLD_COUNTS} and TIMESPAN_SECONDS is {TIMESPAN_SECONDS}.')
-    current_values = context.get_state(lambda: d)
+    logging.debug(
+        f'Set THREASHOLD_COUNTS is {rule.threshold_counts} and TIMESPAN_SECONDS is {TIMESPAN_SECONDS}.')
+    # Failures, all reported calls and slow calls share the same bucket layout.
+    state = CircuitState.load(context.get_state(lambda: None), TIMESPAN_SECONDS, WINDOW_BUCKETS)
+    failure_window, call_window, slow_window = state.windows
     operation = context.operation_name
-    current_utc = datetime.utcnow()
-    current_utc_str = datetime.strftime(current_utc, '%Y-%m-%dT%H:%M:%S')
+    current_epoch = to_epoch(clock.utcnow())
+
+    def open_circuit() -> None:
+        state.status = 'Open'
+        state.open_until = current_epoch + OPEN_DURATION_MINUTES * 60
+        state.success_count = 0
+        state.probe_leases = {}
+        logging.info(f'{context.entity_key} is Open until {state.result()["open_until"]}')
+
+    def should_open() -> bool:
+        return rule.should_open(*state.counts(current_epoch))
 
     try:
-        if current_values['open_until'] is not None:
-            open_until = datetime.strptime(
-                current_values['open_until'], '%Y-%m-%dT%H:%M:%S')
-            if current_utc > open_until:
-                current_values['status'] = 'HalfOpen'
-                current_values['failure_count'] = list()
-                current_values['open_until'] = None
-                logging.info(f'Status changed to {current_values["status"]}')
-                context.set_state(current_values)
+        if state.open_until is not None and current_epoch >= state.open_until:
+            state.status = 'HalfOpen'
+            state.open_until = None
+            state.probe_leases = {}
+            for window in state.windows:
+                window.clear()
+            logging.info(f'Status changed to {state.status}')
+            context.set_state(state.dump(current_epoch))
+            events.publish(context.entity_key, 'Open', 'HalfOpen')
+
+        previous_status = state.status
 
         if operation == "get":
+            logging.debug(f'Get current status {state.status}')
+            context.set_result(state.result())
+
+        elif operation == 'acquire_probe':
+            # lease id -> expiry epoch of probe permits handed out in HalfOpen.
+            probe_leases = state.probe_leases
             result = {
-                'status': current_values['status'],
-                'open_until': current_values['open_until']
+                'status': state.status,
+                'granted': state.status == 'Closed',
+                'lease_id': None
             }
-            logging.debug(f'Get current status {current_values["status"]}')
-            context.set_state(current_values)
+            if state.status == 'HalfOpen':
+                for lease_id, expires in list(probe_leases.items()):
+                    if expires <= current_epoch:
+                        del probe_leases[lease_id]
+                if len(probe_leases) < PROBE_PERMITS:
+                    result['granted'] = True
+                    result['lease_id'] = uuid4().hex
+                    probe_leases[result['lease_id']] = current_epoch + PROBE_LEASE_SECONDS
+                logging.debug(f'Probe permit granted is {result["granted"]}. {len(probe_leases)} permits in use.')
             context.set_result(result)
 
         elif operation == 'reset':
-            new_values = {
-                'status': 'Closed',
-                'failure_count': [],
-                'open_until': None,
-                'success_count': 0
-            }
             logging.debug(f'Reset current status.')
-            context.set_state(new_values)
-            context.set_result(new_values)
-
-        elif operation == "count_failure":
-            logging.info('Evaluate if the status should be changed.')
-            current_values['failure_count'].append(current_utc_str)
-            # Exclude after theshold.
-            sp = current_utc - timedelta(seconds=TIMESPAN_SECONDS)
-            current_failures = [
-                v for v in current_values['failure_count']
-                if datetime.strptime(v, '%Y-%m-%dT%H:%M:%S') > sp
-            ]
-            current_count = len(current_failures)
-
-            new_values = {
-                'status': current_values['status'],
-                'failure_count': current_failures,
-                'open_until': None,
-                'success_count': 0
-            }
+            state.reset()
+            context.set_result(state.result())
 
-            # Update status and open_until
-            if current_count >= THREASHOLD_COUNTS:
-                logging.info(f'Current Failed count is greater than {THREASHOLD_COUNTS}')
-                open_until = current_utc + \
-                    timedelta(minutes=int(OPEN_DURATION_MINUTES))
-                open_until_str = datetime.strftime(
-                    open_until, '%Y-%m-%dT%H:%M:%S')
-                logging.info(f'{context.entity_key} is Open until {open_until_str}')
+        elif operation in ("count_failure", "count_failures"):
+            logging.debug('Evaluate if the status should be changed.')
+            report = context.get_input()
+            if operation == "count_failures":
+                # Aggregated report: {"count": n, "failures": [[epoch, count], ...], "slow_count": n}
+                failures = report.get('failures') or [[current_epoch, report['count']]]
+            else:
+                failures = [[current_epoch, 1]]
+            release_probes(state.probe_leases, report)
 
-                new_values['status'] = 'Open'
-                new_values['open_until'] = open_until_str
+            # Buckets older than TIMESPAN_SECONDS are evicted while adding.
+            for epoch, count in sorted(failures):
+                failure_window.add(min(int(epoch), current_epoch), int(count))
+                call_window.add(min(int(epoch), current_epoch), int(count))
+            slow_window.add(current_epoch, rule.slow_calls(report))
+            state.success_count = 0
 
-            result = {
-                'status': new_values['status'],
-                'open_until': new_values['open_until']
-            }
-            context.set_state(new_values)
-            context.set_result(result)
+            # An Open circuit keeps its open_until, which the HalfOpen transition is scheduled for.
+            if state.status != 'Open' and should_open():
+                logging.info(f'Failures of {context.entity_key} reached the trip threshold')
+                open_circuit()
+            context.set_result(state.result())
+
+        elif operation == 'trip':
+            # Sharded mode: {"failures": n, "calls": n, "slow_calls": n} summed over the shards.
+            report = context.get_input()
+            opened = state.status == 'Closed' and rule.should_open(
+                int(report['failures']), int(report['calls']), int(report['slow_calls']))
+            if opened:
+                open_circuit()
+            context.set_result(dict(state.result(), opened=opened))
+
+        elif operation in ('count_success', 'count_successes'):
+            report = context.get_input()
+            count = int(report['count']) if operation == 'count_successes' else 1
+            if state.status == 'HalfOpen':
+                logging.debug(f'Current status is {state.status}')
+                release_probes(state.probe_leases, report)
+                state.success_count += count
+                if state.success_count >= SUCCESS_COUNTS:
+                    state.reset()
+
+            elif state.status == 'Closed':
+                # Successes only count as calls, so they can open the circuit through the slow call rate.
+                call_window.add(current_epoch, count)
+                slow_window.add(current_epoch, rule.slow_calls(report))
+                if should_open():
+                    logging.info(f'Slow calls of {context.entity_key} reached the trip threshold')
+                    open_circuit()
+            context.set_result(state.result())
 
-        elif operation == 'count_success':
-            if current_values['status'] == 'HalfOpen':
-                logging.info(f'Current status is {current_values["status"]}')
-                current_values['success_count'] += 1
-                if current_values['success_count'] >= SUCCESS_COUNTS:
-                    new_values = {
-                        "status": "Closed",
-                        "failure_count": [],
-                        "open_until": None,
-                        "success_count": 0
-                    }
-                    context.set_state(new_values)
-                    context.set_result(new_values)
-                    return
-                else:
-                    context.set_state(current_values)
+        context.set_state(state.dump(current_epoch))
+        if state.status != previous_status:
+            events.publish(context.entity_key, previous_status, state.status, state.result()['open_until'])
 
     except Exception as e:
         logging.exception(f'Failed Entity Function {e}')
         raise
+    finally:
+        metrics.entity_operation_seconds.labels(operation).observe(time.perf_counter() - started)
 
 main = df.Entity.create(entity_function)
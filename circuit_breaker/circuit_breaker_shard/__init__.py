@@ -0,0 +1,60 @@
+import logging
+import os
+import azure.durable_functions as df
+
+from shared import clock
+from shared.rules import TripRule
+from shared.state import CircuitState
+from shared.window import to_epoch
+
+
+def entity_function(context: df.DurableEntityContext):
+    """Outcome counter for one shard of a circuit, keyed "<entity_key>#<shard>".
+
+    Shards only count failures, calls and slow calls. orchestration_trigger
+    sums them, and circuit_shard_orchestrator opens circuit_breaker_actor,
+    which keeps the status that clients read.
+    """
+
+    TIMESPAN_SECONDS = int(os.environ.get('TIMESPAN_SECONDS', 30))
+    WINDOW_BUCKETS = int(os.environ.get('WINDOW_BUCKETS', 10))
+    rule = TripRule.from_env()
+
+    # Only the windows of the state are used, so a shard persists {"v": 2, "w": [...]}.
+    state = CircuitState.load(context.get_state(lambda: None), TIMESPAN_SECONDS, WINDOW_BUCKETS)
+    failure_window, call_window, slow_window = state.windows
+    operation = context.operation_name
+    current_epoch = to_epoch(clock.utcnow())
+
+    try:
+        report = context.get_input()
+        if operation in ('count_failure', 'count_failures'):
+            if operation == 'count_failures':
+                failures = report.get('failures') or [[current_epoch, report['count']]]
+            else:
+                failures = [[current_epoch, 1]]
+            for epoch, count in sorted(failures):
+                failure_window.add(min(int(epoch), current_epoch), int(count))
+                call_window.add(min(int(epoch), current_epoch), int(count))
+            slow_window.add(current_epoch, rule.slow_calls(report))
+
+        elif operation in ('count_success', 'count_successes'):
+            call_window.add(current_epoch, int(report['count']) if operation == 'count_successes' else 1)
+            slow_window.add(current_epoch, rule.slow_calls(report))
+
+        elif operation == 'reset':
+            state.reset()
+
+        failures, calls, slow_calls = state.counts(current_epoch)
+        context.set_state(state.dump(current_epoch))
+        context.set_result({
+            'failures': failures,
+            'calls': calls,
+            'slow_calls': slow_calls
+        })
+
+    except Exception as e:
+        logging.exception(f'Failed Shard Entity Function {e}')
+        raise
+
+main = df.Entity.create(entity_function)
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+import azure.durable_functions as df
+
+
+def orchestrator_function(context: df.DurableOrchestrationContext):
+    """Open a sharded circuit whose summed shards meet the trip rule and move it to HalfOpen at open_until.
+
+    Runs as <entity_key>-trip, one at a time per circuit. A run whose trip did
+    not open the circuit ends right away, and the next sums that meet the
+    trip rule start a new one.
+    """
+    params = context.get_input()
+    entityId = df.EntityId("circuit_breaker_actor", params['entity_key'])
+    state = yield context.call_entity(entityId, "trip", params['counts'])
+    if not state['opened']:
+        return state
+
+    yield context.task_all([
+        context.call_entity(df.EntityId("circuit_breaker_shard", f'{params["entity_key"]}#{shard}'), "reset")
+        for shard in range(params['shards'])
+    ])
+    open_until = datetime.strptime(state['open_until'], '%Y-%m-%dT%H:%M:%S')
+    yield context.create_timer(open_until)
+    # Any operation after open_until makes the entity change to HalfOpen.
+    state = yield context.call_entity(entityId, "get")
+    return state
+
+main = df.Orchestrator.create(orchestrator_function)
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+import azure.durable_functions as df
+
+
+def orchestrator_function(context: df.DurableOrchestrationContext):
+    """Move an Open circuit to HalfOpen at open_until.
+
+    Started by shared.transition.schedule_half_open with the instance id
+    <entity_key>-<open_until>, so there is one per Open period.
+    """
+    params = context.get_input()
+    entityId = df.EntityId("circuit_breaker_actor", params['entity_key'])
+    open_until = datetime.strptime(params['open_until'], '%Y-%m-%dT%H:%M:%S')
+    yield context.create_timer(open_until)
+    # Any operation after open_until makes the entity change to HalfOpen.
+    state = yield context.call_entity(entityId, "get")
+    return state
+
+main = df.Orchestrator.create(orchestrator_function)
@@ -0,0 +1,12 @@
+import azure.functions as func
+
+from shared import metrics
+
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    """Expose the metrics of this worker process in Prometheus text format."""
+    return func.HttpResponse(
+        status_code=200,
+        body=metrics.render(),
+        headers={'Content-Type': metrics.CONTENT_TYPE}
+    )
@@ -1,31 +1,149 @@
 import logging
+import os
+import random
+from typing import Optional, Tuple
 
 import azure.functions as func
 import azure.durable_functions as df
 
+from shared import clock
+from shared.rules import TripRule
+from shared.state import CircuitState
+from shared.transition import is_running, start_unless_running
+from shared.window import to_epoch
+
+
+def read_state(response, timespan_seconds: int, window_buckets: int) -> Optional[CircuitState]:
+    if not response.entity_exists:
+        return None
+    # Entity state may arrive as a serialized JSON string, which load() accepts too.
+    return CircuitState.load(response.entity_state, timespan_seconds, window_buckets)
+
+
+def read_counts(response, timespan_seconds: int, window_buckets: int) -> Tuple[int, int, int]:
+    state = read_state(response, timespan_seconds, window_buckets)
+    if state is None:
+        return 0, 0, 0
+    return state.counts(to_epoch(clock.utcnow()))
+
+
+async def signal_shard(client: df.DurableOrchestrationClient, entity_key: str, shards: int, operation_name: str, operation_input: dict = None, outcomes: Tuple[int, int, int] = (1, 1, 0)) -> None:
+    """Count outcomes on a random shard of a Closed circuit.
+
+    When the summed shards can open the circuit, at least one of them holds
+    1/shards of the fewest failures or slow calls that can, so the other
+    shards are only read when outcomes land on such a shard. The reads go to
+    entity state and do not queue behind shard operations. If the sums meet
+    the trip rule, circuit_shard_orchestrator opens the circuit. It runs as
+    <entity_key>-trip, and the other shards are not read while it runs, so a
+    failure storm starts one trip at a time.
+    """
+    TIMESPAN_SECONDS = int(os.environ.get('TIMESPAN_SECONDS', 30))
+    WINDOW_BUCKETS = int(os.environ.get('WINDOW_BUCKETS', 10))
+    rule = TripRule.from_env()
+
+    shard = random.randrange(shards)
+    shardId = df.EntityId("circuit_breaker_shard", f'{entity_key}#{shard}')
+    counts = read_counts(await client.read_entity_state(shardId), TIMESPAN_SECONDS, WINDOW_BUCKETS)
+    # Outcomes are kept on the shard whether or not they open the circuit.
+    await client.signal_entity(shardId, operation_name, operation_input)
+    failures, calls, slow_calls = [count + outcome for count, outcome in zip(counts, outcomes)]
+
+    if failures * shards < rule.min_failures() and slow_calls * shards < rule.min_slow_calls():
+        return
+    instance_id = f'{entity_key}-trip'
+    if await is_running(client, instance_id):
+        return
+    for other in range(shards):
+        if other != shard:
+            otherId = df.EntityId("circuit_breaker_shard", f'{entity_key}#{other}')
+            counts = read_counts(await client.read_entity_state(otherId), TIMESPAN_SECONDS, WINDOW_BUCKETS)
+            failures, calls, slow_calls = failures + counts[0], calls + counts[1], slow_calls + counts[2]
+    if rule.should_open(failures, calls, slow_calls):
+        await start_unless_running(client, 'circuit_shard_orchestrator', instance_id, {
+            'entity_key': entity_key,
+            'shards': shards,
+            'counts': {
+                'failures': failures,
+                'calls': calls,
+                'slow_calls': slow_calls
+            }
+        })
+
+
+async def signal_outcomes(client: df.DurableOrchestrationClient, entity_key: str, operation_name: str, operation_input: dict = None, outcomes: Tuple[int, int, int] = (1, 1, 0)) -> None:
+    """Signal (failures, calls, slow calls) to circuit_breaker_actor, or to a shard of a Closed sharded circuit.
+
+    The move to HalfOpen at open_until is scheduled by read_circuit_status
+    once it sees the circuit Open.
+    """
+    CIRCUIT_SHARDS = int(os.environ.get('CIRCUIT_SHARDS', 1))
+
+    entityId = df.EntityId("circuit_breaker_actor", entity_key)
+    if CIRCUIT_SHARDS > 1:
+        TIMESPAN_SECONDS = int(os.environ.get('TIMESPAN_SECONDS', 30))
+        WINDOW_BUCKETS = int(os.environ.get('WINDOW_BUCKETS', 10))
+        state = read_state(await client.read_entity_state(entityId), TIMESPAN_SECONDS, WINDOW_BUCKETS)
+        # Outcomes of a Closed circuit are spread over shards. Once it has opened,
+        # circuit_breaker_actor counts them itself, as traffic is low by then.
+        if state is None or state.status == 'Closed':
+            await signal_shard(client, entity_key, CIRCUIT_SHARDS, operation_name, operation_input, outcomes)
+            return
+
+    await client.signal_entity(entityId, operation_name, operation_input)
+
 
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
+    client = df.DurableOrchestrationClient(starter)
+    return await run(req, client)
+
+
+async def run(req: func.HttpRequest, client: df.DurableOrchestrationClient) -> func.HttpResponse:
 
     func_name = req.route_params["functionName"]
     params = dict(req.params)
-    client = df.DurableOrchestrationClient(starter)
 
     if func_name == 'read_circuit_status_orchestrator':
         instance_id = await client.start_new(func_name, None, params)
         logging.info(f"Started orchestration with ID = '{instance_id}'.")
         return client.create_check_status_response(req, instance_id)
 
-    elif func_name == 'count_failure':
-        entityId = df.EntityId("circuit_breaker_actor", params['entity_key'])
-        await client.signal_entity(entityId, "count_failure")
+    elif func_name == 'read_circuit_statuses_orchestrator':
+        # entity_keys is a comma separated list of keys.
+        entity_keys = [key for key in params['entity_keys'].split(',') if key]
+        instance_id = await client.start_new(func_name, None, {'entity_keys': entity_keys})
+        logging.info(f"Started orchestration with ID = '{instance_id}'.")
+        return client.create_check_status_response(req, instance_id)
+
+    elif func_name == 'acquire_probe_orchestrator':
+        # Permits are needed inline, so wait for the orchestration instead of returning 202 straight away.
+        PROBE_WAIT_MILLISECONDS = int(os.environ.get('PROBE_WAIT_MILLISECONDS', 5000))
+        instance_id = await client.start_new(func_name, None, params)
+        logging.info(f"Started orchestration with ID = '{instance_id}'.")
+        return await client.wait_for_completion_or_create_check_status_response(
+            req, instance_id, timeout_in_milliseconds=PROBE_WAIT_MILLISECONDS, retry_interval_in_milliseconds=100)
+
+    elif func_name in ('count_failure', 'count_success'):
+        # lease_id is set for HalfOpen probes and duration_ms when the client reports call latency.
+        report = {name: params[name] for name in ('lease_id', 'duration_ms') if name in params} or None
+        slow_calls = TripRule.from_env().slow_calls(report)
+        if func_name == 'count_failure':
+            await signal_outcomes(client, params['entity_key'], func_name, report, (1, 1, slow_calls))
+            message = "Function failed to call backend. so added 1 count"
+        else:
+            await signal_outcomes(client, params['entity_key'], func_name, report, (0, 1, slow_calls))
+            message = "Function succeeded to call backend. so added 1 count"
         return func.HttpResponse(
             status_code=200,
-            body="Function failed to call backend. so added 1 count"
+            body=message
         )
-    elif func_name == 'count_success':
-        entityId = df.EntityId("circuit_breaker_actor", params['entity_key'])
-        await client.signal_entity(entityId, "count_success")
+    elif func_name in ('count_failures', 'count_successes'):
+        # Aggregated report posted by the client: {"entity_key": ..., "count": n, "slow_count": n, ...}
+        report = req.get_json()
+        count = int(report['count'])
+        failures = count if func_name == 'count_failures' else 0
+        await signal_outcomes(client, report['entity_key'], func_name, report, (failures, count, int(report.get('slow_count', 0))))
         return func.HttpResponse(
             status_code=200,
-            body="Function succeeded to call backend. so added 1 count"
+            body=f"Function reported {func_name}. so added {report['count']} counts"
         )
\ No newline at end of file
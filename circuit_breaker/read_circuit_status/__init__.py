@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+
+import azure.functions as func
+import azure.durable_functions as df
+
+from shared import clock
+from shared.state import CircuitState
+from shared.transition import schedule_half_open
+from shared.window import to_epoch
+
+
+def current_status(state: CircuitState) -> dict:
+    """Evaluate the stored entity state the same way the entity's get operation does."""
+    result = state.result()
+    if state.open_until is not None and to_epoch(clock.utcnow()) >= state.open_until:
+        # The entity moves to HalfOpen lazily on its next operation.
+        result = {
+            'status': 'HalfOpen',
+            'open_until': None
+        }
+    return result
+
+
+async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
+    client = df.DurableOrchestrationClient(starter)
+    return await run(req, client)
+
+
+async def run(req: func.HttpRequest, client: df.DurableOrchestrationClient) -> func.HttpResponse:
+
+    entity_key = req.params.get('entity_key')
+    if entity_key is None:
+        return func.HttpResponse(
+            status_code=400,
+            body="entity_key is required."
+        )
+
+    entityId = df.EntityId("circuit_breaker_actor", entity_key)
+    response = await client.read_entity_state(entityId)
+
+    if response.entity_exists:
+        # Entity state may arrive as a serialized JSON string, which load() accepts too.
+        state = CircuitState.load(
+            response.entity_state, int(os.environ.get('TIMESPAN_SECONDS', 30)), int(os.environ.get('WINDOW_BUCKETS', 10)))
+        result = current_status(state)
+        if result['status'] != state.status:
+            # Transition was not scheduled, so let the entity change and notify now.
+            await client.signal_entity(entityId, "get")
+        elif state.status == 'Open' and state.open_until is not None:
+            await schedule_half_open(client, entity_key, state.open_until)
+    else:
+        # Entity is created with Closed status on its first operation.
+        result = {
+            'status': 'Closed',
+            'open_until': None
+        }
+
+    logging.debug(f'Read {entity_key} status {result["status"]}')
+    return func.HttpResponse(
+        status_code=200,
+        mimetype='application/json',
+        body=json.dumps(result)
+    )
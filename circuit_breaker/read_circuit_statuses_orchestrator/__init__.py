@@ -0,0 +1,15 @@
+import azure.durable_functions as df
+
+
+def orchestrator_function(context: df.DurableOrchestrationContext):
+    params = context.get_input()
+    entity_keys = params['entity_keys']
+    # Read every entity in parallel and return a single map of key to state.
+    tasks = [
+        context.call_entity(df.EntityId("circuit_breaker_actor", entity_key), "get")
+        for entity_key in entity_keys
+    ]
+    states = yield context.task_all(tasks)
+    return dict(zip(entity_keys, states))
+
+main = df.Orchestrator.create(orchestrator_function)
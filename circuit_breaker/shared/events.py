@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import threading
+import urllib.request
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from . import clock, metrics
+
+_subscribers: List[Callable[[dict], None]] = []
+
+
+def subscribe(callback: Callable[[dict], None]) -> None:
+    """Register an in-process listener, used by the emulator and simulations."""
+    _subscribers.append(callback)
+
+
+def unsubscribe(callback: Callable[[dict], None]) -> None:
+    _subscribers.remove(callback)
+
+
+def publish(entity_key: str, previous_status: str, status: str, open_until: Optional[str] = None) -> None:
+    """Emit a circuit state change to subscribers and STATE_CHANGE_WEBHOOK_URL."""
+    event = {
+        'entity_key': entity_key,
+        'previous_status': previous_status,
+        'status': status,
+        'open_until': open_until,
+        'changed_at': datetime.strftime(clock.utcnow(), '%Y-%m-%dT%H:%M:%S')
+    }
+    logging.info(f'{entity_key} status changed from {previous_status} to {status}')
+    metrics.circuit_transitions_total.labels(entity_key, previous_status, status).inc()
+
+    for callback in list(_subscribers):
+        try:
+            callback(event)
+        except Exception as e:
+            logging.exception(f'Failed to notify state change subscriber {e}')
+
+    url = os.environ.get('STATE_CHANGE_WEBHOOK_URL')
+    if url:
+        # Delivered in the background so the entity operation is not held by the webhook.
+        threading.Thread(target=_post, args=(url, event), daemon=True).start()
+
+
+def _post(url: str, event: dict) -> None:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(event).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        timeout = float(os.environ.get('STATE_CHANGE_WEBHOOK_TIMEOUT_SECONDS', 5))
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+    except Exception as e:
+        logging.error(f'Failed to post state change of {event["entity_key"]} to webhook {e}')
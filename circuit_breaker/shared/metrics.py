@@ -0,0 +1,23 @@
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+
+
+# Seconds. Covers an entity operation (sub millisecond) up to a slow storage round trip.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Metrics of this app only, without the process and platform metrics of the default registry.
+REGISTRY = CollectorRegistry()
+
+
+def render() -> bytes:
+    """Prometheus text exposition format of every metric in REGISTRY."""
+    return generate_latest(REGISTRY)
+
+
+entity_operation_seconds = Histogram(
+    'entity_operation_seconds', 'Time spent in circuit_breaker_actor per operation.', ['operation'],
+    registry=REGISTRY, buckets=DEFAULT_BUCKETS)
+circuit_transitions_total = Counter(
+    'circuit_transitions_total', 'Circuit state changes made by circuit_breaker_actor.', ['entity_key', 'from', 'to'],
+    registry=REGISTRY)
@@ -0,0 +1,72 @@
+import math
+import os
+from typing import Optional
+
+
+class TripRule:
+    """Decides when failures and slow calls in the window open the circuit.
+
+    With failure_rate_threshold at 0 the circuit opens on threshold_counts
+    failures, as before. Otherwise it opens when that percentage of the calls
+    failed. slow_call_rate_threshold opens it when that percentage of the
+    calls took slow_call_duration_ms or longer. Both rates wait for
+    minimum_calls, so a handful of calls cannot open the circuit.
+    """
+
+    def __init__(
+            self,
+            threshold_counts: int = 10,
+            failure_rate_threshold: float = 0,
+            slow_call_rate_threshold: float = 0,
+            slow_call_duration_ms: float = 0,
+            minimum_calls: int = 20) -> None:
+        self.threshold_counts = threshold_counts
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_duration_ms = slow_call_duration_ms
+        self.minimum_calls = max(minimum_calls, 1)
+
+    @classmethod
+    def from_env(cls) -> 'TripRule':
+        return cls(
+            threshold_counts=int(os.environ.get('THREASHOLD_COUNTS', 10)),
+            failure_rate_threshold=float(os.environ.get('FAILURE_RATE_THRESHOLD', 0)),
+            slow_call_rate_threshold=float(os.environ.get('SLOW_CALL_RATE_THRESHOLD', 0)),
+            slow_call_duration_ms=float(os.environ.get('SLOW_CALL_DURATION_MS', 0)),
+            minimum_calls=int(os.environ.get('MINIMUM_CALLS', 20))
+        )
+
+    def is_slow(self, duration_ms) -> bool:
+        return self.slow_call_duration_ms > 0 and duration_ms is not None and float(duration_ms) >= self.slow_call_duration_ms
+
+    def slow_calls(self, report: Optional[dict]) -> int:
+        """Slow calls in an outcome report: slow_count of aggregated reports, or duration_ms of one call."""
+        if not report:
+            return 0
+        if 'slow_count' in report:
+            return int(report['slow_count'])
+        return 1 if self.is_slow(report.get('duration_ms')) else 0
+
+    def should_open(self, failures: int, calls: int, slow_calls: int) -> bool:
+        if self.failure_rate_threshold > 0:
+            if calls >= self.minimum_calls and failures * 100 >= self.failure_rate_threshold * calls:
+                return True
+        elif failures >= self.threshold_counts:
+            return True
+        return (
+            self.slow_call_rate_threshold > 0
+            and calls >= self.minimum_calls
+            and slow_calls * 100 >= self.slow_call_rate_threshold * calls
+        )
+
+    def min_failures(self) -> float:
+        """Fewest failures in the window that can open the circuit."""
+        if self.failure_rate_threshold > 0:
+            return math.ceil(self.failure_rate_threshold * self.minimum_calls / 100)
+        return self.threshold_counts
+
+    def min_slow_calls(self) -> float:
+        """Fewest slow calls in the window that can open the circuit."""
+        if self.slow_call_rate_threshold > 0:
+            return math.ceil(self.slow_call_rate_threshold * self.minimum_calls / 100)
+        return math.inf
@@ -0,0 +1,135 @@
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from .window import FailureWindow, to_epoch
+
+
+SCHEMA_VERSION = 2
+# open_until in operation results, events and version 1 state.
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+V1_WINDOW_FIELDS = ('failure_window', 'call_window', 'slow_window')
+
+
+def format_epoch(epoch: Optional[int]) -> Optional[str]:
+    if epoch is None:
+        return None
+    return time.strftime(TIME_FORMAT, time.gmtime(epoch))
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    return to_epoch(datetime.strptime(value, TIME_FORMAT))
+
+
+class CircuitState:
+    """State of circuit_breaker_actor, also used by circuit_breaker_shard for its windows.
+
+    dump() writes schema version 2 and leaves out fields at their default:
+
+        {"v": 2, "s": "Open", "u": 1700000180, "n": 2, "l": {"<lease id>": 1700000030},
+         "w": [bucket_seconds, head, failures, calls, slow]}
+
+    s is the status (Closed when missing), u is open_until in epoch seconds, n
+    is the HalfOpen success count and l maps probe lease ids to their expiry
+    epoch. The failure, call and slow call windows share bucket_seconds and
+    head, and an empty window is stored as []. load() also migrates version
+    1, the dict with '%Y-%m-%dT%H:%M:%S' strings written before this schema.
+    """
+
+    __slots__ = ('status', 'open_until', 'success_count', 'probe_leases', 'failure_window', 'call_window', 'slow_window')
+
+    def __init__(self, timespan_seconds: int, buckets: int = 10) -> None:
+        self.status = 'Closed'
+        self.open_until: Optional[int] = None
+        self.success_count = 0
+        self.probe_leases: Dict[str, int] = {}
+        self.failure_window = FailureWindow(timespan_seconds, buckets)
+        self.call_window = FailureWindow(timespan_seconds, buckets)
+        self.slow_window = FailureWindow(timespan_seconds, buckets)
+
+    @property
+    def windows(self) -> Tuple[FailureWindow, FailureWindow, FailureWindow]:
+        return self.failure_window, self.call_window, self.slow_window
+
+    @classmethod
+    def load(cls, stored: Any, timespan_seconds: int, buckets: int = 10) -> 'CircuitState':
+        """Read a stored payload of any schema version, its JSON string, or None for a new entity."""
+        if isinstance(stored, str):
+            stored = json.loads(stored)
+        state = cls(timespan_seconds, buckets)
+        if not stored:
+            return state
+        version = stored.get('v', 1)
+        if version == 1:
+            state._migrate_v1(stored)
+        elif version == 2:
+            state._load_v2(stored)
+        else:
+            raise ValueError(f'Unknown circuit state schema version {version}')
+        return state
+
+    def _load_v2(self, stored: dict) -> None:
+        self.status = stored.get('s', 'Closed')
+        self.open_until = stored.get('u')
+        self.success_count = stored.get('n', 0)
+        self.probe_leases = stored.get('l', {})
+        if 'w' in stored:
+            bucket_seconds, head, *counts = stored['w']
+            for window, window_counts in zip(self.windows, counts):
+                if window_counts:
+                    window.restore(bucket_seconds, head, window_counts)
+
+    def _migrate_v1(self, stored: dict) -> None:
+        self.status = stored.get('status', 'Closed')
+        self.open_until = parse_time(stored.get('open_until'))
+        self.success_count = stored.get('success_count', 0)
+        self.probe_leases = stored.get('probe_leases') or {}
+        for window, field in zip(self.windows, V1_WINDOW_FIELDS):
+            stored_window = stored.get(field)
+            if stored_window is not None:
+                window.restore(stored_window['bucket_seconds'], stored_window['head'], stored_window['counts'])
+        # State written before failure_window existed keeps failure timestamps.
+        for value in stored.get('failure_count') or []:
+            self.failure_window.add(parse_time(value))
+
+    def dump(self, epoch: int) -> dict:
+        """Version 2 payload. The windows are advanced to epoch first, so they share one head."""
+        payload: Dict[str, Any] = {'v': SCHEMA_VERSION}
+        if self.status != 'Closed':
+            payload['s'] = self.status
+        if self.open_until is not None:
+            payload['u'] = self.open_until
+        if self.success_count:
+            payload['n'] = self.success_count
+        if self.probe_leases:
+            payload['l'] = self.probe_leases
+        if any(window.total for window in self.windows):
+            bucket_seconds = self.failure_window.bucket_seconds
+            head = max([epoch // bucket_seconds] + [window.head for window in self.windows])
+            for window in self.windows:
+                window.advance(head * bucket_seconds)
+            payload['w'] = [bucket_seconds, head] + [window.counts if window.total else [] for window in self.windows]
+        return payload
+
+    def counts(self, epoch: int) -> Tuple[int, int, int]:
+        """Return (failures, calls, slow calls) in the windows at epoch."""
+        return tuple(window.count(epoch) for window in self.windows)
+
+    def result(self) -> dict:
+        """Status and open_until as operations return them."""
+        return {
+            'status': self.status,
+            'open_until': format_epoch(self.open_until)
+        }
+
+    def reset(self) -> None:
+        self.status = 'Closed'
+        self.open_until = None
+        self.success_count = 0
+        self.probe_leases = {}
+        for window in self.windows:
+            window.clear()
@@ -0,0 +1,59 @@
+import logging
+from typing import Dict
+
+import azure.durable_functions as df
+
+from .state import format_epoch
+
+# entity_key -> open_until of the last Open period scheduled by this worker
+_scheduled: Dict[str, int] = {}
+
+
+async def schedule_half_open(client: df.DurableOrchestrationClient, entity_key: str, open_until: int) -> None:
+    """Start circuit_transition_orchestrator for an Open period unless it is already running.
+
+    The instance id is made of entity_key and open_until, so everything that
+    sees the same Open period asks for the same orchestration and the task
+    hub runs it once.
+    """
+    if _scheduled.get(entity_key) == open_until:
+        return
+    instance_id = f'{entity_key}-{open_until}'
+    status = await client.get_status(instance_id)
+    if status is None or status.runtime_status is None:
+        try:
+            await client.start_new('circuit_transition_orchestrator', instance_id, {
+                'entity_key': entity_key,
+                'open_until': format_epoch(open_until)
+            })
+            logging.info(f"Started orchestration with ID = '{instance_id}'.")
+        except Exception as e:
+            # Also raised when another worker started it after get_status. The next read tries again.
+            logging.warning(f'Failed to start orchestration {instance_id}. {e}')
+            return
+    _scheduled[entity_key] = open_until
+
+
+
+async def is_running(client: df.DurableOrchestrationClient, instance_id: str) -> bool:
+    status = await client.get_status(instance_id)
+    return status is not None and status.runtime_status in (
+        df.OrchestrationRuntimeStatus.Pending, df.OrchestrationRuntimeStatus.Running)
+
+
+async def start_unless_running(client: df.DurableOrchestrationClient, name: str, instance_id: str, orchestration_input: dict) -> bool:
+    """Start orchestration name as instance_id unless that instance is still pending or running.
+
+    A finished instance is replaced, so one instance id serves any number of
+    runs one after the other. Returns whether this call started it.
+    """
+    if await is_running(client, instance_id):
+        return False
+    try:
+        await client.start_new(name, instance_id, orchestration_input)
+    except Exception as e:
+        # Raised when another worker started it after get_status.
+        logging.debug(f'Did not start orchestration {instance_id}. {e}')
+        return False
+    logging.info(f"Started orchestration with ID = '{instance_id}'.")
+    return True
@@ -4,6 +4,10 @@ import os
 import azure.functions as func
 from uuid import uuid4
 
+from shared.breaker import get_breaker
+from shared.cache import circuit_state_cache
+from shared.fallback import fallback_cache, request_key
+from shared.probe import acquire_probe_permit
 from shared.utils import polling_durable, call_backend
 
 
@@ -20,10 +24,34 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
     }
     params = dict(req.params)
 
-    # Call Durable Function to get circuit breaker state
+    # BREAKER_MODE=local decides in process and syncs with Durable Function in background.
+    # Otherwise read circuit breaker state from the in-process cache and
+    # call Durable Function only when the cached state is expired.
     # Error when Durable Function returned status >= 400
     try:
-        result = await polling_durable(CIRCUIT_URL, headers=headers, params=params, max_retry=5)
+        if os.environ.get('BREAKER_MODE', 'durable') == 'local':
+            entity_key = params.get('entity_key')
+            breaker = get_breaker(entity_key)
+
+            # The loader outlives this request, so every sync gets its own ids.
+            async def sync_state() -> dict:
+                sync_headers = {
+                    'Content-Type': 'application/json',
+                    'X-Func-Request-Id': str(uuid4()),
+                    'X-Func-Correlation-Id': str(uuid4())
+                }
+                return await polling_durable(CIRCUIT_URL, headers=sync_headers, params={'entity_key': entity_key}, max_retry=5)
+
+            breaker.start_sync(sync_state, float(os.environ.get('LOCAL_SYNC_SECONDS', 5)))
+            result = {
+                'message': breaker.state(),
+                'error': False
+            }
+        else:
+            result = await circuit_state_cache.get(
+                params.get('entity_key'),
+                lambda: polling_durable(CIRCUIT_URL, headers=headers, params=params, max_retry=5)
+            )
     except Exception as e:
         return func.HttpResponse(
             status_code=500,
@@ -49,7 +77,33 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
             )
         )
     else:
-        if result['message']['status'] != 'Closed':
+        # In HalfOpen only the requests holding a probe permit reach the backend.
+        lease_id = None
+        status = result['message']['status']
+        if status == 'HalfOpen':
+            permit = await acquire_probe_permit(headers, params.get('entity_key'))
+            if permit is not None and permit['granted']:
+                lease_id = permit['lease_id']
+                status = 'Closed'
+
+        # FALLBACK_CACHE=true keeps recent successful responses to serve while the circuit is not Closed.
+        use_fallback = os.environ.get('FALLBACK_CACHE', 'false').lower() == 'true'
+        fallback_key = request_key(os.environ.get('BACKEND_URL'), params)
+
+        if status != 'Closed' and use_fallback:
+            fallback = await fallback_cache.get(fallback_key)
+            if fallback is not None:
+                logging.info(f'Circuit is {status}. Serve fallback response of {fallback["age"]} seconds old.')
+                return func.HttpResponse(
+                    status_code=fallback['status'],
+                    headers=dict(
+                        fallback['headers'],
+                        **{'Age': str(fallback['age']), 'Warning': '110 - "Response is Stale"', 'X-Circuit-Status': status}
+                    ),
+                    body=fallback['body']
+                )
+
+        if status != 'Closed':
             return func.HttpResponse(
                 status_code=500,
                 headers={'Content-Type': 'application/json'},
@@ -63,6 +117,8 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
 
         else:
             url = os.environ.get('BACKEND_URL')
+            # BACKEND_PASSTHROUGH=true returns the backend status, headers and body as they are.
+            passthrough = os.environ.get('BACKEND_PASSTHROUGH', 'false').lower() == 'true'
             req_id = str(uuid4())
             headers = {
                 'Content-Type': 'application/json',
@@ -70,7 +126,8 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                 'X-Func-Correlation-Id': col_id
             }
             try:
-                backend_result = await call_backend(url, headers=headers, params=params, max_retry=1)
+                backend_result = await call_backend(
+                    url, headers=headers, params=params, max_retry=1, lease_id=lease_id, passthrough=passthrough)
             except Exception as e:
                 logging.exception(
                     f'Failed to call backend {e}'
@@ -80,7 +137,18 @@ async def main(req: func.HttpRequest) -> func.HttpResponse:
                     body=json.dumps("Failed to call backend", indent=2)
                 )
 
-            return func.HttpResponse(
-                status_code=200,
-                body=json.dumps(backend_result, indent=2)
-            )
+            if 'backend_body' in backend_result:
+                response = func.HttpResponse(
+                    status_code=backend_result['backend_status'],
+                    headers=backend_result['backend_headers'],
+                    body=backend_result['backend_body']
+                )
+            else:
+                # A call that ran out of retries answers with its own status, so it is not taken for a success.
+                response = func.HttpResponse(
+                    status_code=backend_result['backend_status'] if backend_result.get('exhausted') else 200,
+                    body=json.dumps(backend_result, indent=2)
+                )
+            if use_fallback and backend_result['backend_status'] == 200 and not backend_result.get('exhausted'):
+                fallback_cache.put(fallback_key, response.status_code, dict(response.headers), response.get_body())
+            return response
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import os
+import azure.functions as func
+from uuid import uuid4
+
+from shared import metrics
+from shared.breaker import local_breakers
+from shared.cache import circuit_state_cache
+from shared.probe import probe_half_open, probe_targets
+
+# Probes started by events, kept so they are not collected while running.
+_probes = set()
+
+
+def _probe_done(future: asyncio.Future) -> None:
+    _probes.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f'Failed to probe after state change {future.exception()}')
+
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    """Receive state changes pushed by circuit_breaker_actor."""
+    event = req.get_json()
+    entity_key = event['entity_key']
+    logging.info(
+        f'{entity_key} status changed from {event["previous_status"]} to {event["status"]}')
+    metrics.circuit_transitions_total.labels(entity_key, event['previous_status'], event['status']).inc()
+
+    state = {
+        'status': event['status'],
+        'open_until': event['open_until']
+    }
+    circuit_state_cache.set(entity_key, {
+        'message': state,
+        'error': False
+    })
+    breaker = local_breakers.get(entity_key)
+    if breaker is not None:
+        breaker.apply(state)
+
+    # Probe right away instead of waiting for the next check_status tick. The
+    # probe runs in the background, as the webhook gives up after a few seconds.
+    if event['status'] == 'HalfOpen':
+        params = {
+            'entity_key': entity_key,
+            'status': 'ok'
+        }
+        # The backend of a PROBE_TARGETS entry, BACKEND_URL otherwise.
+        url = next((target.url for target in probe_targets() if target.entity_key == entity_key), None)
+        probe = asyncio.ensure_future(
+            probe_half_open(params, str(uuid4()), url, float(os.environ.get('PROBE_TIMEOUT_SECONDS', 10))))
+        probe.add_done_callback(_probe_done)
+        _probes.add(probe)
+
+    return func.HttpResponse(status_code=200)
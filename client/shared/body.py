@@ -0,0 +1,53 @@
+import asyncio
+import os
+from typing import Mapping, Optional
+
+from aiohttp import ClientResponse
+
+
+# Bytes of a backend body kept for logs and results.
+BACKEND_PREVIEW_BYTES = int(os.environ.get('BACKEND_PREVIEW_BYTES', 1024))
+# Largest backend body passed through to the caller.
+BACKEND_MAX_BODY_BYTES = int(os.environ.get('BACKEND_MAX_BODY_BYTES', 10 * 1024 * 1024))
+BACKEND_CHUNK_BYTES = int(os.environ.get('BACKEND_CHUNK_BYTES', 64 * 1024))
+
+# Hop-by-hop headers and the ones describing the wire encoding, which the
+# Functions host sets again for the new response.
+DROPPED_HEADERS = frozenset({
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+    'trailer', 'transfer-encoding', 'upgrade', 'content-length', 'content-encoding'
+})
+
+
+def preview(body: bytes, limit: int = BACKEND_PREVIEW_BYTES) -> str:
+    text = body[:limit].decode('utf-8', errors='replace')
+    if len(body) > limit:
+        text += f'... ({len(body)} bytes)'
+    return text
+
+
+async def read_preview(response: ClientResponse, limit: int = BACKEND_PREVIEW_BYTES) -> str:
+    """Read at most limit bytes of the body and leave the rest unread."""
+    try:
+        body = await response.content.readexactly(limit + 1)
+    except asyncio.IncompleteReadError as e:
+        body = e.partial
+    if len(body) > limit:
+        return body[:limit].decode('utf-8', errors='replace') + '...'
+    return body.decode('utf-8', errors='replace')
+
+
+async def read_body(response: ClientResponse, limit: int = BACKEND_MAX_BODY_BYTES) -> Optional[bytes]:
+    """Read the body in chunks into one buffer, or return None once it exceeds limit."""
+    if response.content_length is not None and response.content_length > limit:
+        return None
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(BACKEND_CHUNK_BYTES):
+        if len(body) + len(chunk) > limit:
+            return None
+        body += chunk
+    return bytes(body)
+
+
+def passthrough_headers(headers: Mapping[str, str]) -> dict:
+    return {name: value for name, value in headers.items() if name.lower() not in DROPPED_HEADERS}
@@ -0,0 +1,158 @@
+import asyncio
+import calendar
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from . import clock
+from .rules import TripRule
+from .window import FailureWindow
+
+
+class LocalCircuitBreaker:
+    """In-process Closed/Open/HalfOpen state machine.
+
+    Follows the same rules as circuit_breaker_actor so a decision takes no
+    network call: failures, calls and slow calls are counted in the same
+    bucketed windows and TripRule decides when they open the circuit. Methods
+    never await, which keeps every transition atomic on the event loop. An
+    optional sync task adopts the durable entity state periodically, so the
+    entity stays the source of truth across instances.
+    """
+
+    def __init__(self, rule: Optional[TripRule] = None, timespan_seconds: int = 30, window_buckets: int = 10, open_duration_minutes: int = 3, success_counts: int = 5) -> None:
+        self.rule = rule or TripRule()
+        self.open_duration_minutes = open_duration_minutes
+        self.success_counts = success_counts
+        self.status = 'Closed'
+        self.open_until: Optional[int] = None
+        self.success_count = 0
+        self.failure_window = FailureWindow(timespan_seconds, window_buckets)
+        self.call_window = FailureWindow(timespan_seconds, window_buckets)
+        self.slow_window = FailureWindow(timespan_seconds, window_buckets)
+        self._sync_task: Optional[asyncio.Future] = None
+
+    def state(self) -> dict:
+        self._expire()
+        open_until = None
+        if self.open_until is not None:
+            open_until = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.open_until))
+        return {
+            'status': self.status,
+            'open_until': open_until
+        }
+
+    def allow_request(self) -> bool:
+        self._expire()
+        return self.status == 'Closed'
+
+    def record_failure(self, duration_ms: Optional[float] = None) -> None:
+        self._expire()
+        epoch = int(clock.now())
+        self.failure_window.add(epoch)
+        self.call_window.add(epoch)
+        self.slow_window.add(epoch, 1 if self.rule.is_slow(duration_ms) else 0)
+        self.success_count = 0
+        # An Open circuit keeps its open_until, like circuit_breaker_actor.
+        if self.status != 'Open' and self._should_open(epoch):
+            self._open(epoch)
+
+    def record_success(self, duration_ms: Optional[float] = None) -> None:
+        self._expire()
+        if self.status == 'HalfOpen':
+            self.success_count += 1
+            if self.success_count >= self.success_counts:
+                self._close()
+        elif self.status == 'Closed':
+            # Successes only count as calls, so they can open the circuit through the slow call rate.
+            epoch = int(clock.now())
+            self.call_window.add(epoch)
+            self.slow_window.add(epoch, 1 if self.rule.is_slow(duration_ms) else 0)
+            if self._should_open(epoch):
+                self._open(epoch)
+
+    def apply(self, remote: dict) -> None:
+        """Adopt the state read from the durable entity."""
+        open_until = None
+        if remote.get('open_until') is not None:
+            open_until = calendar.timegm(
+                datetime.strptime(remote['open_until'], '%Y-%m-%dT%H:%M:%S').utctimetuple())
+        if remote['status'] == self.status and open_until == self.open_until:
+            return
+        if remote['status'] != self.status:
+            logging.info(f'Local circuit status changed from {self.status} to {remote["status"]} by sync')
+            if remote['status'] == 'Closed':
+                self._close()
+                return
+            self.status = remote['status']
+            self.success_count = 0
+            if self.status == 'HalfOpen':
+                self._clear_windows()
+        self.open_until = open_until
+
+    def start_sync(self, loader: Callable[[], Awaitable[dict]], interval_seconds: float) -> None:
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.ensure_future(self._sync(loader, interval_seconds))
+
+    def stop_sync(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    async def _sync(self, loader: Callable[[], Awaitable[dict]], interval_seconds: float) -> None:
+        while True:
+            try:
+                result = await loader()
+                if result['error'] is False:
+                    self.apply(result['message'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception(f'Failed to sync local circuit {e}')
+            await clock.sleep(interval_seconds)
+
+    def _should_open(self, epoch: int) -> bool:
+        return self.rule.should_open(
+            self.failure_window.count(epoch), self.call_window.count(epoch), self.slow_window.count(epoch))
+
+    def _open(self, epoch: int) -> None:
+        self.status = 'Open'
+        self.open_until = epoch + self.open_duration_minutes * 60
+        self.success_count = 0
+        logging.info(f'Local circuit is Open until {self.state()["open_until"]}')
+
+    def _expire(self) -> None:
+        if self.status == 'Open' and self.open_until is not None and clock.now() >= self.open_until:
+            self.status = 'HalfOpen'
+            self.open_until = None
+            self._clear_windows()
+            logging.info(f'Local circuit status changed to {self.status}')
+
+    def _close(self) -> None:
+        self.status = 'Closed'
+        self.open_until = None
+        self.success_count = 0
+        self._clear_windows()
+
+    def _clear_windows(self) -> None:
+        for window in (self.failure_window, self.call_window, self.slow_window):
+            window.clear()
+
+
+local_breakers: Dict[str, LocalCircuitBreaker] = {}
+
+
+def get_breaker(entity_key: str) -> LocalCircuitBreaker:
+    breaker = local_breakers.get(entity_key)
+    if breaker is None:
+        breaker = LocalCircuitBreaker(
+            rule=TripRule.from_env(),
+            timespan_seconds=int(os.environ.get('TIMESPAN_SECONDS', 30)),
+            window_buckets=int(os.environ.get('WINDOW_BUCKETS', 10)),
+            open_duration_minutes=int(os.environ.get('OPEN_DURATION_MINUTES', 3)),
+            success_counts=int(os.environ.get('SUCCESS_COUNTS', 5))
+        )
+        local_breakers[entity_key] = breaker
+    return breaker
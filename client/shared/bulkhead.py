@@ -0,0 +1,85 @@
+import asyncio
+import os
+from typing import Dict
+from urllib.parse import urlsplit
+
+from . import metrics
+
+
+class BulkheadFull(Exception):
+    """Raised when a call cannot get a slot. reason is 'queue_full' or 'queue_timeout'."""
+
+    def __init__(self, backend: str, reason: str) -> None:
+        super().__init__(f'Bulkhead of {backend} rejected the call due to {reason}')
+        self.backend = backend
+        self.reason = reason
+
+
+class Bulkhead:
+    """Caps concurrent calls to one backend.
+
+    At most max_concurrent calls run at once. Up to max_queue more wait for
+    queue_timeout seconds, and anything beyond that is rejected right away, so
+    a slow backend cannot pile up coroutines, sockets and retry timers.
+    """
+
+    def __init__(self, backend: str, max_concurrent: int, max_queue: int = 0, queue_timeout: float = 1) -> None:
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._in_flight = metrics.bulkhead_in_flight.labels(backend)
+        self._queue_depth = metrics.bulkhead_queue_depth.labels(backend)
+
+    async def acquire(self) -> None:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject('queue_full')
+            self.waiting += 1
+            self._queue_depth.inc()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject('queue_timeout')
+            finally:
+                self.waiting -= 1
+                self._queue_depth.dec()
+        else:
+            await self._semaphore.acquire()
+        self._in_flight.inc()
+
+    def release(self) -> None:
+        self._in_flight.dec()
+        self._semaphore.release()
+
+    def _reject(self, reason: str) -> None:
+        metrics.bulkhead_rejections_total.labels(self.backend, reason).inc()
+        raise BulkheadFull(self.backend, reason)
+
+    async def __aenter__(self) -> 'Bulkhead':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+
+bulkheads: Dict[str, Bulkhead] = {}
+
+
+def get_bulkhead(url: str) -> Bulkhead:
+    """Bulkhead of the backend host of url. BULKHEAD_MAX_CONCURRENT=0 disables the limit."""
+    backend = urlsplit(url).netloc
+    bulkhead = bulkheads.get(backend)
+    if bulkhead is None:
+        max_concurrent = int(os.environ.get('BULKHEAD_MAX_CONCURRENT', 0))
+        bulkhead = Bulkhead(
+            backend,
+            max_concurrent=max_concurrent if max_concurrent > 0 else 2 ** 31,
+            max_queue=int(os.environ.get('BULKHEAD_MAX_QUEUE', 100)),
+            queue_timeout=float(os.environ.get('BULKHEAD_QUEUE_TIMEOUT_SECONDS', 1))
+        )
+        bulkheads[backend] = bulkhead
+    return bulkhead
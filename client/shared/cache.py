@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict
+
+from . import clock
+
+
+class CircuitStateCache:
+    """In-process cache of circuit breaker states keyed by entity_key.
+
+    Entries younger than ttl_seconds are served as is. Entries older than that
+    but younger than ttl_seconds + stale_seconds are served while a single
+    background refresh runs. Anything older is refreshed before returning.
+    Concurrent refreshes for the same entity_key share one in-flight call.
+    """
+
+    def __init__(self, ttl_seconds: float = 5, stale_seconds: float = 30) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: Dict[str, tuple] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get(self, entity_key: str, loader: Callable[[], Awaitable[dict]]) -> dict:
+        entry = self._entries.get(entity_key)
+        if entry is not None:
+            age = clock.monotonic() - entry[0]
+            if age < self.ttl_seconds:
+                return entry[1]
+            if age < self.ttl_seconds + self.stale_seconds:
+                logging.debug(f'Serve stale circuit state for {entity_key}. Age: {age:.1f}s')
+                self._refresh(entity_key, loader)
+                return entry[1]
+
+        return await asyncio.shield(self._refresh(entity_key, loader))
+
+    def set(self, entity_key: str, result: dict) -> None:
+        if result.get('error') is False:
+            self._entries[entity_key] = (clock.monotonic(), result)
+
+    def invalidate(self, entity_key: str) -> None:
+        self._entries.pop(entity_key, None)
+
+    def _refresh(self, entity_key: str, loader: Callable[[], Awaitable[dict]]) -> asyncio.Future:
+        future = self._inflight.get(entity_key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(entity_key, loader))
+            future.add_done_callback(self._log_failure)
+            self._inflight[entity_key] = future
+        return future
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f'Failed to refresh circuit state {future.exception()}')
+
+    async def _load(self, entity_key: str, loader: Callable[[], Awaitable[dict]]) -> dict:
+        try:
+            result = await loader()
+            # Errors are returned to the waiting callers but never cached.
+            self.set(entity_key, result)
+            return result
+        finally:
+            self._inflight.pop(entity_key, None)
+
+
+circuit_state_cache = CircuitStateCache(
+    ttl_seconds=float(os.environ.get('CIRCUIT_CACHE_TTL_SECONDS', 5)),
+    stale_seconds=float(os.environ.get('CIRCUIT_CACHE_STALE_SECONDS', 30))
+)
@@ -0,0 +1,82 @@
+"""Time source of the app, replaceable for simulations.
+
+Code reads time through clock.now(), clock.monotonic() and clock.utcnow() and
+waits with clock.sleep(). They use the system clock until install() puts a
+VirtualClock in place, which lets a simulation run hours of circuit breaker
+time in seconds.
+"""
+import asyncio
+import time
+from datetime import datetime
+
+
+class SystemClock:
+    def now(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def utcnow(self) -> datetime:
+        return datetime.utcnow()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock(SystemClock):
+    """Clock that only moves when advanced.
+
+    sleep() moves the clock to the wake-up time at once and yields to the
+    event loop, so a retry chain of a minute returns right away. That is exact
+    for one flow at a time. Concurrent sleepers each move the clock, so
+    simulations drive concurrent traffic with advance_to() instead.
+    """
+
+    def __init__(self, start: float = 0) -> None:
+        self._now = float(start)
+
+    def now(self) -> float:
+        return self._now
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def utcnow(self) -> datetime:
+        return datetime.utcfromtimestamp(self._now)
+
+    async def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+        await asyncio.sleep(0)
+
+    def advance(self, seconds: float) -> None:
+        self._now += max(seconds, 0)
+
+    def advance_to(self, epoch: float) -> None:
+        self._now = max(self._now, epoch)
+
+
+_clock: SystemClock = SystemClock()
+
+
+def install(clock: SystemClock) -> SystemClock:
+    """Read time from clock from now on and return the clock it replaces."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def now() -> float:
+    return _clock.now()
+
+
+def monotonic() -> float:
+    return _clock.monotonic()
+
+
+def utcnow() -> datetime:
+    return _clock.utcnow()
+
+
+async def sleep(seconds: float) -> None:
+    await _clock.sleep(seconds)
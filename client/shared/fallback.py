@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlencode, urlsplit
+
+from . import clock
+
+
+def request_key(url: str, params: Optional[dict]) -> str:
+    """Backend path plus params sorted by name, so equal requests share an entry."""
+    query = urlencode(sorted((params or {}).items()))
+    return f'{urlsplit(url).path}?{query}'
+
+
+class FallbackCache:
+    """Recent successful backend responses, served stale while the circuit is not Closed.
+
+    Memory holds at most max_entries responses in LRU order. When disk_dir is
+    set every response is also written there and read back on a memory miss,
+    so a restarted instance still has fallbacks. A key is written to disk at
+    most once per disk_refresh_seconds, a tenth of ttl_seconds by default.
+    Disk I/O runs in the default executor and keeps at most disk_max_entries
+    files. Entries older than ttl_seconds are never served.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, max_body_bytes: int = 1024 * 1024, disk_dir: Optional[str] = None, disk_max_entries: int = 10000, disk_refresh_seconds: Optional[float] = None) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_refresh_seconds = disk_refresh_seconds if disk_refresh_seconds is not None else ttl_seconds / 10
+        self.max_body_bytes = max_body_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries: 'OrderedDict[str, dict]' = OrderedDict()
+        self._disk_writes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Return {"status", "headers", "body", "age"} or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        elif self.disk_dir:
+            entry = await asyncio.get_event_loop().run_in_executor(None, self._read, key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            return None
+
+        age = clock.now() - entry['stored_at']
+        if age > self.ttl_seconds:
+            self._entries.pop(key, None)
+            return None
+        return dict(entry, age=int(age))
+
+    def put(self, key: str, status: int, headers: dict, body: bytes) -> None:
+        if len(body) > self.max_body_bytes:
+            return
+        now = clock.now()
+        entry = {
+            'stored_at': now,
+            'status': status,
+            'headers': dict(headers),
+            'body': body,
+            'written_at': now
+        }
+        previous = self._entries.get(key)
+        # The file on disk is recent enough, so only memory takes the new response.
+        skip_disk = previous is not None and now - previous['written_at'] < self.disk_refresh_seconds
+        if skip_disk:
+            entry['written_at'] = previous['written_at']
+        self._remember(key, entry)
+        if self.disk_dir and not skip_disk:
+            future = asyncio.get_event_loop().run_in_executor(None, self._write, key, entry)
+            future.add_done_callback(self._log_failure)
+
+    def _remember(self, key: str, entry: dict) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _read(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+            if meta.get('key') != key:
+                return None
+            return {
+                'stored_at': float(meta['stored_at']),
+                'status': int(meta['status']),
+                'headers': dict(meta['headers']),
+                'body': body,
+                'written_at': float(meta['stored_at'])
+            }
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # A truncated or corrupt file is a miss, and is removed so it is not read again.
+            logging.error(f'Failed to read fallback response from disk {e}')
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write(self, key: str, entry: dict) -> None:
+        path = self._path(key)
+        meta = {
+            'key': key,
+            'stored_at': entry['stored_at'],
+            'status': entry['status'],
+            'headers': entry['headers']
+        }
+        # Written aside and renamed, so a reader never sees half a file. Each
+        # write gets its own temp file, as executor threads may write one key at once.
+        fd, temp = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8') + b'\n')
+                f.write(entry['body'])
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except FileNotFoundError:
+                pass
+            raise
+
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune()
+
+    def _prune(self) -> None:
+        paths = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if not name.endswith('.tmp')]
+        if len(paths) <= self.disk_max_entries:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.disk_max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f'Failed to write fallback response to disk {future.exception()}')
+
+
+fallback_cache = FallbackCache(
+    max_entries=int(os.environ.get('FALLBACK_CACHE_MAX_ENTRIES', 1000)),
+    ttl_seconds=float(os.environ.get('FALLBACK_CACHE_TTL_SECONDS', 3600)),
+    max_body_bytes=int(os.environ.get('FALLBACK_CACHE_MAX_BODY_BYTES', 1024 * 1024)),
+    disk_dir=os.environ.get('FALLBACK_CACHE_DIR') or None,
+    disk_max_entries=int(os.environ.get('FALLBACK_CACHE_DISK_MAX_ENTRIES', 10000)),
+    disk_refresh_seconds=float(os.environ.get('FALLBACK_CACHE_DISK_REFRESH_SECONDS', 360))
+)
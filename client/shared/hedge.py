@@ -0,0 +1,79 @@
+import asyncio
+import math
+import os
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from . import metrics
+
+
+T = TypeVar('T')
+
+
+class LatencyTracker:
+    """Rolling percentile of recent backend latencies, used as the hedge delay.
+
+    The percentile is recomputed every refresh_every samples, so observing
+    stays O(1) on the hot path.
+    """
+
+    def __init__(self, size: int = 200, percentile: float = 95, initial_seconds: float = 0.1, min_samples: int = 20, refresh_every: int = 20) -> None:
+        self.percentile = percentile
+        self.initial_seconds = initial_seconds
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self._samples = deque(maxlen=size)
+        self._since_refresh = 0
+        self._delay: Optional[float] = None
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh_every and len(self._samples) >= self.min_samples:
+            ordered = sorted(self._samples)
+            self._delay = ordered[max(math.ceil(self.percentile / 100 * len(ordered)), 1) - 1]
+            self._since_refresh = 0
+
+    def delay(self) -> float:
+        return self._delay if self._delay is not None else self.initial_seconds
+
+
+async def first_good(start: Callable[[], Awaitable[T]], is_good: Callable[[T], bool], delay: float, hedges: int = 1) -> T:
+    """Run start(), and start it again after each delay without an answer, up to hedges extra times.
+
+    Returns the first result that is_good accepts and cancels the other
+    attempts. When none is good, returns the last result or raises the last
+    exception, so the caller's retry loop decides what happens next.
+    """
+    pending = {asyncio.ensure_future(start())}
+    started = 1
+    last_result = None
+    last_error: Optional[BaseException] = None
+    try:
+        while pending:
+            timeout = delay if started <= hedges else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                pending.add(asyncio.ensure_future(start()))
+                started += 1
+                metrics.backend_hedges_total.inc()
+                continue
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                elif is_good(task.result()):
+                    return task.result()
+                else:
+                    last_result = task.result()
+        if last_result is not None:
+            return last_result
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+backend_latency = LatencyTracker(
+    percentile=float(os.environ.get('BACKEND_HEDGE_PERCENTILE', 95)),
+    initial_seconds=float(os.environ.get('BACKEND_HEDGE_DELAY_MS', 100)) / 1000
+)
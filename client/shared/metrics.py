@@ -0,0 +1,38 @@
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+
+# Seconds. Covers a cache hit (sub millisecond) up to a durable poll with retries.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Metrics of this app only, without the process and platform metrics of the default registry.
+REGISTRY = CollectorRegistry()
+
+
+def render() -> bytes:
+    """Prometheus text exposition format of every metric in REGISTRY."""
+    return generate_latest(REGISTRY)
+
+
+circuit_state_read_seconds = Histogram(
+    'circuit_state_read_seconds', 'Time to read the circuit state from Durable Functions.', ['outcome'],
+    registry=REGISTRY, buckets=DEFAULT_BUCKETS)
+backend_request_seconds = Histogram(
+    'backend_request_seconds', 'Time to call the backend including retries.', ['status'],
+    registry=REGISTRY, buckets=DEFAULT_BUCKETS)
+backend_hedges_total = Counter(
+    'backend_hedges_total', 'Hedged backend requests started because the first attempt was slow.', registry=REGISTRY)
+retry_attempts = Histogram(
+    'retry_attempts', 'Attempts used per call.', ['call'], registry=REGISTRY, buckets=(1, 2, 3, 4, 5, 8, 10))
+retry_backoff_seconds_total = Counter(
+    'retry_backoff_seconds_total', 'Seconds spent waiting between retries.', ['call'], registry=REGISTRY)
+circuit_transitions_total = Counter(
+    'circuit_transitions_total', 'Circuit state changes seen by this client.', ['entity_key', 'from', 'to'],
+    registry=REGISTRY)
+bulkhead_in_flight = Gauge(
+    'bulkhead_in_flight', 'Backend calls holding a bulkhead slot.', ['backend'], registry=REGISTRY)
+bulkhead_queue_depth = Gauge(
+    'bulkhead_queue_depth', 'Backend calls waiting for a bulkhead slot.', ['backend'], registry=REGISTRY)
+bulkhead_rejections_total = Counter(
+    'bulkhead_rejections_total', 'Backend calls rejected by the bulkhead.', ['backend', 'reason'], registry=REGISTRY)
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional
+from uuid import uuid4
+
+from . import clock
+from .reporter import OutcomeReporter
+from .utils import call_backend, polling_durable, read_circuit_statuses, report_failure
+
+
+class ProbeTarget(NamedTuple):
+    entity_key: str
+    url: str
+
+
+def probe_targets() -> List[ProbeTarget]:
+    """Circuits checked by check_status.
+
+    PROBE_TARGETS is a comma separated list of entity_key=backend url, where a
+    bare entity_key uses BACKEND_URL. Without it ENTITY_KEY is checked on
+    BACKEND_URL.
+    """
+    backend_url = os.environ.get('BACKEND_URL')
+    targets = []
+    for item in os.environ.get('PROBE_TARGETS', '').split(','):
+        entity_key, _, url = item.strip().partition('=')
+        if entity_key:
+            targets.append(ProbeTarget(entity_key, url or backend_url))
+    if not targets and os.environ.get('ENTITY_KEY'):
+        targets.append(ProbeTarget(os.environ['ENTITY_KEY'], backend_url))
+    return targets
+
+
+# entity_key -> acquisition in flight, shared by concurrent callers
+_acquiring: Dict[str, asyncio.Future] = {}
+# entity_key -> clock.monotonic() until which a denied permit is assumed
+_denied_until: Dict[str, float] = {}
+
+
+async def acquire_probe_permit(headers: dict, entity_key: str) -> Optional[dict]:
+    """Ask circuit_breaker_actor for a HalfOpen probe permit.
+
+    Returns {"granted": bool, "lease_id": str or None, "status": str}, or None
+    when the permit could not be read. The number of permits in flight is
+    bounded by PROBE_PERMITS of the circuit_breaker app.
+
+    Only one acquisition per entity_key runs at a time in this instance. A
+    permit goes to the caller that started it and everyone who waited on it
+    is denied. A denial is remembered for PROBE_LEASE_SECONDS, the longest a
+    lease taken elsewhere can be held, so requests in the meantime are denied
+    without calling the circuit breaker.
+    """
+    denied_until = _denied_until.get(entity_key)
+    if denied_until is not None:
+        if clock.monotonic() < denied_until:
+            return {'status': 'HalfOpen', 'granted': False, 'lease_id': None}
+        _denied_until.pop(entity_key, None)
+
+    future = _acquiring.get(entity_key)
+    if future is not None:
+        permit = await asyncio.shield(future)
+        if permit is None:
+            return None
+        return dict(permit, granted=False, lease_id=None)
+
+    future = asyncio.ensure_future(_acquire(headers, entity_key))
+    _acquiring[entity_key] = future
+    return await asyncio.shield(future)
+
+
+async def _acquire(headers: dict, entity_key: str) -> Optional[dict]:
+    try:
+        PROBE_URL = os.environ.get('PROBE_URL')
+        result = await polling_durable(PROBE_URL, headers=headers, params={'entity_key': entity_key}, max_retry=3)
+        if result['error'] is True:
+            logging.error(f'Failed to acquire probe permit for {entity_key}. {result["message"]}')
+            return None
+        permit = result['message']
+        if permit['status'] == 'HalfOpen' and not permit['granted']:
+            PROBE_LEASE_SECONDS = float(os.environ.get('PROBE_LEASE_SECONDS', 30))
+            _denied_until[entity_key] = clock.monotonic() + PROBE_LEASE_SECONDS
+        return permit
+    finally:
+        _acquiring.pop(entity_key, None)
+
+
+async def probe_half_open(params: dict, col_id: str, url: Optional[str] = None, timeout: Optional[float] = None, reporter: Optional[OutcomeReporter] = None) -> Optional[bool]:
+    """Call the backend once while the circuit is HalfOpen.
+
+    Acquiring the permit and calling the backend together are bounded by
+    timeout seconds. The outcome is queued on reporter when one is given and
+    reported by call_backend otherwise. Any answer below 500 counts as a
+    success, so the permit is released whatever the status. Returns whether
+    the backend answered 200, or None when no permit was granted.
+    """
+    url = url or os.environ.get('BACKEND_URL')
+    entity_key = params['entity_key']
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Func-Request-Id': str(uuid4()),
+        'X-Func-Correlation-Id': col_id
+    }
+    started = clock.monotonic()
+    lease_ids = []
+
+    async def probe() -> Optional[dict]:
+        permit = await acquire_probe_permit(headers, entity_key)
+        if permit is None or not permit['granted']:
+            return None
+        lease_ids.append(permit['lease_id'])
+        return await call_backend(
+            url, headers=headers, params=params, max_retry=1, lease_id=permit['lease_id'], report=reporter is None)
+
+    try:
+        backend_result = await asyncio.wait_for(probe(), timeout)
+    except asyncio.TimeoutError:
+        logging.error(f'Probe of {entity_key} timed out after {timeout} seconds.')
+        if not lease_ids:
+            return None
+        backend_result = {
+            'backend_status': 504,
+            'backend_message': 'Probe timed out'
+        }
+        if reporter is None:
+            # call_backend was cancelled before it could report.
+            await report_failure(headers, params, lease_ids[0], (clock.monotonic() - started) * 1000)
+    except Exception as e:
+        logging.exception(f'Failed to call backend {e}')
+        return False
+
+    if backend_result is None:
+        logging.info(f'Probe permits of {entity_key} are in use. Skip probing in HalfOpen.')
+        return None
+
+    succeeded = backend_result['backend_status'] == 200
+    if reporter is not None:
+        duration_ms = (clock.monotonic() - started) * 1000
+        if backend_result['backend_status'] < 500:
+            reporter.success(entity_key, lease_ids[0], duration_ms)
+        else:
+            reporter.failure(entity_key, lease_ids[0], duration_ms)
+
+    if not succeeded:
+        logging.error(f'Failed to call backend of {entity_key} in HalfOpen.')
+        return False
+
+    logging.info(
+        f'Succeeded to call backend of {entity_key} in HalfOpen. Add success count.')
+    return True
+
+
+async def read_statuses(headers: dict, entity_keys: List[str], concurrency: int) -> Dict[str, str]:
+    """Return entity_key -> status, leaving out keys that could not be read.
+
+    With BULK_CIRCUIT_URL every key is read by one orchestration, otherwise
+    CIRCUIT_URL is called for at most concurrency keys at once.
+    """
+    BULK_CIRCUIT_URL = os.environ.get('BULK_CIRCUIT_URL')
+    if BULK_CIRCUIT_URL:
+        result = await read_circuit_statuses(BULK_CIRCUIT_URL, headers, entity_keys)
+        if result['error'] is True:
+            logging.error(f'Failed to read circuit statuses. {result["message"]}')
+            return {}
+        return {entity_key: state['status'] for entity_key, state in result['message'].items()}
+
+    CIRCUIT_URL = os.environ.get('CIRCUIT_URL')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read(entity_key: str) -> dict:
+        async with semaphore:
+            return await polling_durable(CIRCUIT_URL, headers=headers, params={'entity_key': entity_key}, max_retry=5)
+
+    results = await asyncio.gather(*[read(entity_key) for entity_key in entity_keys], return_exceptions=True)
+    statuses = {}
+    for entity_key, result in zip(entity_keys, results):
+        if isinstance(result, Exception):
+            logging.error(f'Failed to call circuit breaker for {entity_key}. {result}')
+        elif result['error'] is True:
+            logging.error(f'Failed to read circuit status of {entity_key}. {result["message"]}')
+        else:
+            statuses[entity_key] = result['message']['status']
+    return statuses
+
+
+async def run_probes(targets: List[ProbeTarget], concurrency: int = 10, timeout: float = 10) -> dict:
+    """Probe every HalfOpen circuit among targets in parallel.
+
+    At most concurrency probes run at once, each bounded by timeout seconds, so
+    a round takes about as long as the slowest probe rather than the sum of
+    all of them. With BATCH_FAILURE_URL and BATCH_SUCCESS_URL set, outcomes are
+    sent after the round as one count_failures / count_successes per
+    entity_key. Returns the number of targets in each outcome.
+    """
+    col_id = str(uuid4())
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Func-Request-Id': str(uuid4()),
+        'X-Func-Correlation-Id': col_id
+    }
+    entity_keys = sorted({target.entity_key for target in targets})
+    statuses = await read_statuses(headers, entity_keys, concurrency)
+    half_open = [target for target in targets if statuses.get(target.entity_key) == 'HalfOpen']
+
+    reporter = None
+    failure_url, success_url = os.environ.get('BATCH_FAILURE_URL'), os.environ.get('BATCH_SUCCESS_URL')
+    if failure_url and success_url:
+        reporter = OutcomeReporter(
+            failure_url, success_url, flush_seconds=None,
+            slow_call_duration_ms=float(os.environ.get('SLOW_CALL_DURATION_MS', 0)))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(target: ProbeTarget) -> Optional[bool]:
+        async with semaphore:
+            params = {
+                'entity_key': target.entity_key,
+                'status': 'ok'
+            }
+            return await probe_half_open(params, col_id, target.url, timeout, reporter)
+
+    outcomes = await asyncio.gather(*[probe(target) for target in half_open])
+    if reporter is not None:
+        await reporter.flush()
+
+    summary = {
+        'targets': len(targets),
+        'unread': len(entity_keys) - len(statuses),
+        'half_open': len(half_open),
+        'succeeded': outcomes.count(True),
+        'failed': outcomes.count(False),
+        'skipped': outcomes.count(None)
+    }
+    logging.info(f'Probed HalfOpen circuits. {summary}')
+    return summary
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+
+from . import clock
+from .cache import circuit_state_cache
+from .session import get_session
+
+
+class OutcomeReporter:
+    """Coalesce failure and success reports per entity_key.
+
+    Reports are kept in memory for flush_seconds and then sent as a single
+    count_failures / count_successes operation per entity_key, so a backend
+    outage costs one entity operation per flush instead of one per request.
+    With flush_seconds=None reports are only sent by an explicit flush().
+    """
+
+    def __init__(self, failure_url: Optional[str], success_url: Optional[str], flush_seconds: Optional[float] = 1, slow_call_duration_ms: float = 0) -> None:
+        self.failure_url = failure_url
+        self.success_url = success_url
+        self.flush_seconds = flush_seconds
+        # Aggregated reports carry slow call counts, so calls are classified here.
+        self.slow_call_duration_ms = slow_call_duration_ms
+        # entity_key -> {epoch seconds: failure count}
+        self._failures: Dict[str, Dict[int, int]] = {}
+        self._successes: Dict[str, int] = {}
+        # entity_key -> HalfOpen probe permits released by the next report
+        self._failure_leases: Dict[str, List[str]] = {}
+        self._success_leases: Dict[str, List[str]] = {}
+        self._slow_failures: Dict[str, int] = {}
+        self._slow_successes: Dict[str, int] = {}
+        self._flush_task: Optional[asyncio.Future] = None
+
+    def failure(self, entity_key: str, lease_id: Optional[str] = None, duration_ms: Optional[float] = None) -> None:
+        per_second = self._failures.setdefault(entity_key, {})
+        epoch = int(clock.now())
+        per_second[epoch] = per_second.get(epoch, 0) + 1
+        if lease_id is not None:
+            self._failure_leases.setdefault(entity_key, []).append(lease_id)
+        if self._is_slow(duration_ms):
+            self._slow_failures[entity_key] = self._slow_failures.get(entity_key, 0) + 1
+        self._schedule()
+
+    def success(self, entity_key: str, lease_id: Optional[str] = None, duration_ms: Optional[float] = None) -> None:
+        self._successes[entity_key] = self._successes.get(entity_key, 0) + 1
+        if lease_id is not None:
+            self._success_leases.setdefault(entity_key, []).append(lease_id)
+        if self._is_slow(duration_ms):
+            self._slow_successes[entity_key] = self._slow_successes.get(entity_key, 0) + 1
+        self._schedule()
+
+    def _is_slow(self, duration_ms: Optional[float]) -> bool:
+        return self.slow_call_duration_ms > 0 and duration_ms is not None and duration_ms >= self.slow_call_duration_ms
+
+    def _schedule(self) -> None:
+        if self.flush_seconds is None:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await clock.sleep(self.flush_seconds)
+        await self.flush()
+
+    async def flush(self) -> None:
+        failures, self._failures = self._failures, {}
+        successes, self._successes = self._successes, {}
+        failure_leases, self._failure_leases = self._failure_leases, {}
+        success_leases, self._success_leases = self._success_leases, {}
+        slow_failures, self._slow_failures = self._slow_failures, {}
+        slow_successes, self._slow_successes = self._slow_successes, {}
+
+        reports = [
+            self._post(self.failure_url, {
+                'entity_key': entity_key,
+                'count': sum(per_second.values()),
+                'failures': sorted([epoch, count] for epoch, count in per_second.items()),
+                'slow_count': slow_failures.get(entity_key, 0),
+                'lease_ids': failure_leases.get(entity_key, [])
+            })
+            for entity_key, per_second in failures.items()
+        ] + [
+            self._post(self.success_url, {
+                'entity_key': entity_key,
+                'count': count,
+                'slow_count': slow_successes.get(entity_key, 0),
+                'lease_ids': success_leases.get(entity_key, [])
+            })
+            for entity_key, count in successes.items()
+        ]
+        await asyncio.gather(*reports)
+
+    async def _post(self, url: str, report: dict) -> None:
+        try:
+            session = get_session()
+            async with session.post(url, json=report) as response:
+                if response.status != 200:
+                    message = await response.text()
+                    logging.error(
+                        f'Failed to report {report["count"]} outcomes for {report["entity_key"]}. Status: {response.status}. Message: {message}')
+        except Exception as e:
+            logging.exception(f'Failed to report outcomes for {report["entity_key"]} {e}')
+        # The cached state is outdated once the report is counted.
+        circuit_state_cache.invalidate(report['entity_key'])
+
+
+outcome_reporter = OutcomeReporter(
+    failure_url=os.environ.get('BATCH_FAILURE_URL'),
+    success_url=os.environ.get('BATCH_SUCCESS_URL'),
+    flush_seconds=float(os.environ.get('REPORT_FLUSH_SECONDS', 1)),
+    slow_call_duration_ms=float(os.environ.get('SLOW_CALL_DURATION_MS', 0))
+)
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import random
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional, Tuple, Type
+
+from aiohttp.client_exceptions import ClientConnectionError
+
+from . import clock
+
+
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+RETRY_EXCEPTIONS = (ClientConnectionError, asyncio.TimeoutError)
+
+
+class RetryPolicy:
+    """Full-jitter exponential backoff with a max delay and a total deadline.
+
+    max_attempts counts every call including the first one, so a policy with
+    max_attempts=1 never retries.
+    """
+
+    def __init__(
+            self,
+            max_attempts: int = 5,
+            base_delay: float = float(os.environ.get('RETRY_BASE_DELAY_SECONDS', 0.5)),
+            max_delay: float = float(os.environ.get('RETRY_MAX_DELAY_SECONDS', 8)),
+            deadline: float = float(os.environ.get('RETRY_DEADLINE_SECONDS', 30)),
+            retry_statuses: frozenset = RETRY_STATUSES,
+            retry_exceptions: Tuple[Type[BaseException], ...] = RETRY_EXCEPTIONS) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_statuses = retry_statuses
+        self.retry_exceptions = retry_exceptions
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def start(self) -> 'RetryState':
+        return RetryState(self)
+
+
+class RetryState:
+    """Tracks attempts and the deadline budget of a single call."""
+
+    def __init__(self, policy: RetryPolicy) -> None:
+        self.policy = policy
+        self.attempts = 1
+        self.started = clock.monotonic()
+        # Seconds handed out by next_delay, for the retry metrics.
+        self.waited = 0.0
+
+    def remaining(self) -> float:
+        return self.policy.deadline - (clock.monotonic() - self.started)
+
+    def next_delay(self, retry_after: Optional[float] = None) -> Optional[float]:
+        """Return seconds to wait before the next attempt, or None when exhausted."""
+        if self.attempts >= self.policy.max_attempts:
+            return None
+
+        if retry_after is not None:
+            delay = min(retry_after, self.policy.max_delay)
+        else:
+            delay = self.policy.backoff(self.attempts)
+
+        if delay >= self.remaining():
+            return None
+
+        self.attempts += 1
+        self.waited += delay
+        return delay
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Read a Retry-After header given either in seconds or as an HTTP date."""
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        # '-0000' dates parse without a zone and are UTC.
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(retry_at.timestamp() - clock.now(), 0.0)
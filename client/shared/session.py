@@ -0,0 +1,55 @@
+"""The aiohttp ClientSession shared by every outbound call of the client app.
+
+The Functions host has no shutdown hook for the Python worker, so there the
+session lives as long as the worker process and its connections are closed
+with it. Servers that run the functions themselves, such as
+benchmark.stand_in, call close_session() when they shut down.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import aiohttp
+
+
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared ClientSession, creating it on first use.
+
+    All outbound calls of the function app reuse this session so keep-alive
+    connections and DNS results are pooled across requests and retries.
+    """
+    global _session, _session_loop
+
+    loop = asyncio.get_event_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.environ.get('HTTP_POOL_LIMIT', 100)),
+            limit_per_host=int(os.environ.get('HTTP_POOL_LIMIT_PER_HOST', 20)),
+            ttl_dns_cache=int(os.environ.get('HTTP_DNS_CACHE_SECONDS', 300)),
+            keepalive_timeout=float(os.environ.get('HTTP_KEEPALIVE_SECONDS', 30))
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=float(os.environ.get('HTTP_TOTAL_TIMEOUT_SECONDS', 30)),
+            connect=float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', 5))
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _session_loop = loop
+        logging.info('Created shared HTTP session.')
+
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared ClientSession and release its pooled connections."""
+    global _session, _session_loop
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logging.info('Closed shared HTTP session.')
+    _session = None
+    _session_loop = None
@@ -2,67 +2,97 @@ import asyncio
 import json
 import logging
 import os
-from typing import Optional
+from typing import Awaitable, List, Optional
 
-import aiohttp
-from aiohttp.client_exceptions import ClientConnectionError
+from aiohttp import ClientTimeout
 
+from . import clock, metrics
+from .body import passthrough_headers, preview, read_body, read_preview
+from .breaker import local_breakers
+from .bulkhead import BulkheadFull, get_bulkhead
+from .cache import circuit_state_cache
+from .hedge import backend_latency, first_good
+from .reporter import outcome_reporter
+from .retry import RetryPolicy, RetryState, parse_retry_after
+from .session import get_session
 
-async def polling_durable(url: str, headers: dict,  params: Optional[dict] = None, call_count: Optional[int] = 1, max_retry: Optional[int] = 5) -> dict:
 
-    request_id = headers['X-Func-Request-Id']
-    correlation_id = headers['X-Func-Correlation-Id']
+# 'immediate' signals the entity per request, 'batched' coalesces reports per entity_key.
+REPORT_MODE = os.environ.get('REPORT_MODE', 'immediate')
+# Report every backend call with its duration, not only failures and HalfOpen probes.
+# Needed by the failure rate and slow call rate rules of circuit_breaker_actor.
+REPORT_CALLS = os.environ.get('REPORT_CALLS', 'false').lower() == 'true'
 
-    if call_count > max_retry:
-        logging.error(
-            f'Reached max durable call count. Request ID: {request_id}. Correlation ID: {correlation_id}')
-        result = {
-            'message': f'Reached max durable call count {os.environ.get("MAX_DURABLE_CALL_COUNT")}',
-            'error': True
-        }
-        return result
+BACKEND_ATTEMPT_TIMEOUT_SECONDS = float(os.environ.get('BACKEND_ATTEMPT_TIMEOUT_SECONDS', 10))
+BACKEND_TOTAL_TIMEOUT_SECONDS = float(os.environ.get('BACKEND_TOTAL_TIMEOUT_SECONDS', 30))
+BACKEND_HEDGE = os.environ.get('BACKEND_HEDGE', 'false').lower() == 'true'
+# Extra requests a hedged attempt may send.
+BACKEND_HEDGE_MAX = int(os.environ.get('BACKEND_HEDGE_MAX', 1))
+
+# Success reports sent in the background, kept so they are not collected while running.
+_pending_reports = set()
 
+
+def observe_retries(call: str, retry: RetryState) -> None:
+    metrics.retry_attempts.labels(call).observe(retry.attempts)
+    if retry.waited:
+        metrics.retry_backoff_seconds_total.labels(call).inc(retry.waited)
+
+
+async def polling_durable(url: str, headers: dict,  params: Optional[dict] = None, max_retry: Optional[int] = 5, policy: Optional[RetryPolicy] = None) -> dict:
+    policy = policy or RetryPolicy(max_attempts=max_retry)
+    retry = policy.start()
+    outcome = 'exception'
     try:
-        async with aiohttp.ClientSession() as poll_session:
+        result = await _polling_durable(url, headers, params, policy, retry)
+        outcome = 'error' if result['error'] else 'ok'
+        return result
+    finally:
+        metrics.circuit_state_read_seconds.labels(outcome).observe(clock.monotonic() - retry.started)
+        observe_retries('polling_durable', retry)
+
+
+async def _polling_durable(url: str, headers: dict, params: Optional[dict], policy: RetryPolicy, retry: RetryState) -> dict:
+    request_id = headers['X-Func-Request-Id']
+    correlation_id = headers['X-Func-Correlation-Id']
+    poll_session = get_session()
+
+    while True:
+        retry_after = None
+        try:
             async with poll_session.get(url, headers=headers, params=params) as poll_response:
                 polling_status = poll_response.status
                 # same as runtimeStatus = 'Pending'
                 if polling_status == 202:
                     logging.info(
-                        f'Retry request. Status: {polling_status}. Call Count: {call_count} Request ID: {request_id}. Correlation ID: {correlation_id}'
+                        f'Retry request. Status: {polling_status}. Call Count: {retry.attempts} Request ID: {request_id}. Correlation ID: {correlation_id}'
                     )
-                    retry_url = poll_response.headers['Location']
-                    await asyncio.sleep(2 ** call_count)
-                    call_count += 1
-                    result = await polling_durable(
-                        retry_url,
-                        headers=headers,
-                        call_count=call_count,
-                        params=params
-                    )
-                elif polling_status >= 500:
+                    url = poll_response.headers['Location']
+                    retry_after = parse_retry_after(poll_response.headers)
+                elif polling_status in policy.retry_statuses:
                     logging.info(
-                        f'Retry request. Status: {polling_status}. Call Count: {call_count} Request ID: {request_id}. Correlation ID: {correlation_id}'
-                    )
-                    await asyncio.sleep(2 ** call_count)
-                    call_count += 1
-                    result = await polling_durable(
-                        url,
-                        headers=headers,
-                        call_count=call_count,
-                        params=params,
+                        f'Retry request. Status: {polling_status}. Call Count: {retry.attempts} Request ID: {request_id}. Correlation ID: {correlation_id}'
                     )
+                    retry_after = parse_retry_after(poll_response.headers)
 
-                # Completed Orchestrator
+                # Completed Orchestrator or direct entity read
                 elif polling_status == 200:
                     resp_body = await poll_response.json()
+                    # circuit_status route returns the entity state inline
+                    if 'runtimeStatus' not in resp_body:
+                        logging.info(
+                            f'Read entity state directly.  Request ID: {request_id}')
+                        return {
+                            'message': resp_body,
+                            'error': False
+                        }
                     # If Durable Function failed inside
-                    if resp_body['runtimeStatus'] == 'Failed' or resp_body['runtimeStatus'] == 'Terminated':
+                    elif resp_body['runtimeStatus'] == 'Failed' or resp_body['runtimeStatus'] == 'Terminated':
                         message = resp_body['output']
                         logging.error(
-                            f'Durable function failed due to {message}. Status: {polling_status}. Call Count: {call_count}. Request ID: {request_id}. Correlation ID: {correlation_id}'
+                            f'Durable function failed due to {message}. Status: {polling_status}. Call Count: {retry.attempts}. Request ID: {request_id}. Correlation ID: {correlation_id}'
                         )
-                        result = {
+                        return {
                             'message': resp_body['output'],
                             'error': True
                         }
@@ -71,115 +101,337 @@ async def polling_durable(url: str, headers: dict,  params: Optional[dict] = Non
                         message = resp_body['output']
                         logging.info(
                             f'Durable function completed.  Request ID: {request_id}')
-                        result = {
+                        return {
                             'message': resp_body['output'],
                             'error': False
                         }
+                    # Still Pending or Running
+                    else:
+                        logging.info(
+                            f'Retry request. Runtime Status: {resp_body["runtimeStatus"]}. Call Count: {retry.attempts} Request ID: {request_id}. Correlation ID: {correlation_id}'
+                        )
                 else:
                     message = await poll_response.text()
                     logging.error(
-                        f'Durable function failed due to {message}. Status: {polling_status}. Call Count: {call_count}. Request ID: {request_id}. Correlation ID: {correlation_id}')
-                    result = {
+                        f'Durable function failed due to {message}. Status: {polling_status}. Call Count: {retry.attempts}. Request ID: {request_id}. Correlation ID: {correlation_id}')
+                    return {
                         'message': f'Client Error. status is {polling_status}, message is {message}',
                         'error': True
                     }
-    except ClientConnectionError as ce:
+        except policy.retry_exceptions as ce:
+            logging.exception(
+                f'Exception request: {ce}. Request ID: {request_id}. Correlation ID: {correlation_id}'
+            )
+
+        except Exception as e:
+            logging.exception(
+                f'Exception on requesting current state: {e}. Request ID: {request_id}')
+            raise
+
+        delay = retry.next_delay(retry_after)
+        if delay is None:
+            logging.error(
+                f'Reached max durable call count. Request ID: {request_id}. Correlation ID: {correlation_id}')
+            return {
+                'message': f'Reached max durable call count {retry.attempts}',
+                'error': True
+            }
+        await clock.sleep(delay)
+
+
+async def read_circuit_statuses(url: str, headers: dict, entity_keys: List[str], max_retry: Optional[int] = 5) -> dict:
+    """Read the state of many entities with one orchestration and refresh the cache."""
+    params = {'entity_keys': ','.join(entity_keys)}
+    result = await polling_durable(url, headers=headers, params=params, max_retry=max_retry)
+    if result['error'] is False:
+        for entity_key, state in result['message'].items():
+            circuit_state_cache.set(entity_key, {
+                'message': state,
+                'error': False
+            })
+    return result
+
+
+def report_params(params: dict, lease_id: Optional[str], duration_ms: Optional[float]) -> dict:
+    if lease_id is not None:
+        params = dict(params, lease_id=lease_id)
+    if duration_ms is not None:
+        params = dict(params, duration_ms=round(duration_ms))
+    return params
+
+
+async def report_failure(headers: dict, params: Optional[dict] = None, lease_id: Optional[str] = None, duration_ms: Optional[float] = None) -> dict:
+    breaker = local_breakers.get(params.get('entity_key')) if params is not None else None
+    if breaker is not None:
+        breaker.record_failure(duration_ms)
+
+    if REPORT_MODE == 'batched':
+        outcome_reporter.failure(params['entity_key'], lease_id, duration_ms)
+        return {
+            'backend_status': 202,
+            'backend_message': 'Failure is queued for reporting.'
+        }
+
+    circuit_breakder_url = os.environ.get('FAILURE_URL')
+    # The cached state is outdated once a failure is counted.
+    if params is not None:
+        circuit_state_cache.invalidate(params.get('entity_key'))
+        params = report_params(params, lease_id, duration_ms)
+    try:
+        session = get_session()
+        async with session.get(circuit_breakder_url, headers=headers, params=params) as response:
+            message = await response.text()
+            result = {
+                'backend_status': response.status,
+                'backend_message': message
+            }
+    except Exception as e:
         logging.exception(
-            f'Exception request: {ce}. Request ID: {request_id}. Correlation ID: {correlation_id}'
-        )
-        await asyncio.sleep(2 ** call_count)
-        call_count += 1
-        result = await polling_durable(
-            url,
-            headers=headers,
-            call_count=call_count,
-            params=params,
+            f'Failed to cal durable entity {e}'
         )
+        result = {
+            'backend_status': 500,
+            'backend_message': f'Failed to report failure {e}'
+        }
+    return result
 
+
+async def report_success(headers: dict, params: Optional[dict] = None, lease_id: Optional[str] = None, duration_ms: Optional[float] = None) -> dict:
+    breaker = local_breakers.get(params.get('entity_key')) if params is not None else None
+    if breaker is not None:
+        breaker.record_success(duration_ms)
+
+    if REPORT_MODE == 'batched':
+        outcome_reporter.success(params['entity_key'], lease_id, duration_ms)
+        return {
+            'backend_status': 202,
+            'backend_message': 'Success is queued for reporting.'
+        }
+
+    SUCCESS_URL = os.environ.get('SUCCESS_URL')
+    params = report_params(params, lease_id, duration_ms)
+    try:
+        session = get_session()
+        async with session.get(SUCCESS_URL, headers=headers, params=params) as response:
+            message = await response.text()
+            result = {
+                'backend_status': response.status,
+                'backend_message': message
+            }
     except Exception as e:
         logging.exception(
-            f'Exception on requesting current state: {e}. Request ID: {request_id}')
-        raise
-
+            f'Failed to cal durable entity {e}'
+        )
+        result = {
+            'backend_status': 500,
+            'backend_message': f'Failed to report success {e}'
+        }
     return result
 
 
-async def call_backend(url: str, headers: dict,  params: Optional[dict] = None, call_count: Optional[int] = 1, max_retry: Optional[int] = 3) -> dict:
+def report_success_later(headers: dict, params: Optional[dict] = None, duration_ms: Optional[float] = None) -> None:
+    """Send report_success in the background, for calls that only count towards the rate rules."""
+    task = asyncio.ensure_future(report_success(headers, params, None, duration_ms))
+    _pending_reports.add(task)
+    task.add_done_callback(_log_report)
+
+
+def _log_report(task: asyncio.Future) -> None:
+    _pending_reports.discard(task)
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        logging.error(f'Failed to report success {task.exception()}')
+    elif task.result()['backend_status'] not in (200, 202):
+        logging.error(f'Failed to report success. {task.result()["backend_message"]}')
+
+
+async def call_backend(url: str, headers: dict,  params: Optional[dict] = None, max_retry: Optional[int] = 3, policy: Optional[RetryPolicy] = None, lease_id: Optional[str] = None, passthrough: bool = False, report: bool = True) -> dict:
+    """Call the backend and report a failure once retries are exhausted.
+
+    lease_id is the HalfOpen probe permit the call runs under. Successful
+    calls are reported when they hold a permit or REPORT_CALLS is set, and
+    calls that run out of retries are reported as failures. REPORT_CALLS
+    successes are reported in the background, so the call does not wait for
+    the circuit breaker. A call holding a permit reports every final answer,
+    so the permit is released at once: a status below 500 is a success and
+    any other status is a failure.
+
+    Only a preview of the body is kept in backend_message. With passthrough
+    the result also has the raw backend_body, up to BACKEND_MAX_BODY_BYTES,
+    and backend_headers to return to the caller as they are, including the
+    last backend answer of a call that ran out of retries.
+
+    The call, retries included, holds a slot of the backend's bulkhead. A call
+    the bulkhead rejects gets backend_status 503 and is reported as a failure.
+
+    A call that runs out of retries returns exhausted=True with the status of
+    its last attempt: the backend's status, 504 when the attempt timed out or
+    502 when the backend could not be reached. report=False leaves reporting
+    to the caller.
+    """
+    policy = policy or RetryPolicy(max_attempts=max_retry, deadline=BACKEND_TOTAL_TIMEOUT_SECONDS)
+    retry = policy.start()
+    status = 'exception'
+    bulkhead = get_bulkhead(url)
+    try:
+        try:
+            await bulkhead.acquire()
+        except BulkheadFull as e:
+            status = 'rejected'
+            logging.warning(f'{e}. Request ID: {headers["X-Func-Request-Id"]}')
+            if report:
+                report_result = await report_failure(headers, params, lease_id)
+                if report_result['backend_status'] not in (200, 202):
+                    logging.error(f'Failed to report rejection. {report_result["backend_message"]}')
+            return {
+                'backend_status': 503,
+                'backend_message': str(e)
+            }
+        try:
+            result = await _call_backend(url, headers, params, policy, retry, passthrough)
+        finally:
+            bulkhead.release()
+        duration_ms = (clock.monotonic() - retry.started) * 1000
+        if not result.get('exhausted'):
+            status = result['backend_status']
+            if report and lease_id is not None:
+                # The backend answered, so the probe is over either way.
+                if status < 500:
+                    report_result = await report_success(headers, params, lease_id, duration_ms)
+                else:
+                    report_result = await report_failure(headers, params, lease_id, duration_ms)
+                if report_result['backend_status'] not in (200, 202):
+                    logging.error(f'Failed to report probe outcome. {report_result["backend_message"]}')
+            elif report and status == 200 and REPORT_CALLS:
+                report_success_later(headers, params, duration_ms)
+            return result
+        status = 'exhausted'
+        logging.error(
+            f'Reached max durable call count. Request ID: {headers["X-Func-Request-Id"]}')
+        if report:
+            report_result = await report_failure(headers, params, lease_id, duration_ms)
+            if report_result['backend_status'] not in (200, 202):
+                logging.error(f'Failed to report failure. {report_result["backend_message"]}')
+        return result
+    finally:
+        metrics.backend_request_seconds.labels(status).observe(clock.monotonic() - retry.started)
+        observe_retries('call_backend', retry)
+
+
+async def _backend_attempt(session, url: str, headers: dict, params: Optional[dict], passthrough: bool, timeout_seconds: float, retry_statuses: frozenset) -> dict:
+    """Send one backend request bounded by timeout_seconds and read its body."""
+    started = clock.monotonic()
+    timeout = ClientTimeout(total=max(timeout_seconds, 0.001))
+    async with session.get(url, headers=headers, params=params, timeout=timeout) as response:
+        attempt = {
+            'status': response.status,
+            'body': None,
+            'headers': response.headers,
+            'too_large': False
+        }
+        if passthrough:
+            attempt['body'] = await read_body(response)
+            attempt['too_large'] = attempt['body'] is None
+            attempt['message'] = preview(attempt['body'] or b'')
+        else:
+            attempt['message'] = await read_preview(response)
+    if response.status not in retry_statuses:
+        backend_latency.observe(clock.monotonic() - started)
+    return attempt
+
+
+async def _call_backend(url: str, headers: dict, params: Optional[dict], policy: RetryPolicy, retry: RetryState, passthrough: bool) -> dict:
+    """Return the backend result, or the last failure with exhausted=True once retries are exhausted.
+
+    Each attempt is bounded by BACKEND_ATTEMPT_TIMEOUT_SECONDS and by what is
+    left of the policy deadline. With BACKEND_HEDGE=true a second request is
+    sent when the first has not answered within the recent p95 latency.
+    """
     request_id = headers['X-Func-Request-Id']
     correlation_id = headers['X-Func-Correlation-Id']
+    session = get_session()
 
-    if call_count > max_retry:
-        logging.error(
-            f'Reached max durable call count. Request ID: {request_id}')
-        circuit_breakder_url = os.environ.get('FAILURE_URL')
+    def start() -> Awaitable[dict]:
+        return _backend_attempt(
+            session, url, headers, params, passthrough, min(BACKEND_ATTEMPT_TIMEOUT_SECONDS, retry.remaining()), policy.retry_statuses)
+
+    # Status and message the call ends with if no attempt succeeds, and the
+    # backend answer behind them.
+    last_status, last_message = 502, 'Backend is unreachable'
+    last_attempt: Optional[dict] = None
+    while True:
+        retry_after = None
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(circuit_breakder_url, headers=headers, params=params) as response:
-                    message = await response.text()
-                    result = {
-                        'backend_status': response.status,
-                        'backend_message': message
-                    }
-        except Exception as e:
-            logging.exception(
-                f'Failed to cal durable entity'
-            )
-        return result
+            if BACKEND_HEDGE:
+                attempt = await first_good(
+                    start, lambda a: a['status'] not in policy.retry_statuses, backend_latency.delay(), BACKEND_HEDGE_MAX)
+            else:
+                attempt = await start()
+            status = attempt['status']
+            message = attempt['message']
+            if attempt['too_large'] and status not in policy.retry_statuses:
+                logging.error(
+                    f'Backend response is too large to pass through. Status: {status}. Request ID: {request_id}. Correlation ID: {correlation_id}')
+                return {
+                    'backend_status': 502,
+                    'backend_message': f'Backend response exceeded the size limit. status is {status}'
+                }
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                status = response.status
-                # same as runtimeStatus = 'Pending'
-                if status >= 500:
-                    message = await response.text()
-                    logging.error(
-                        f'Retry request. Message: {message}. Status: {status}. Call Count: {call_count}. Request ID: {request_id}. Correlation ID: {correlation_id}'
-                    )
-                    await asyncio.sleep(2 ** call_count)
-                    call_count += 1
-                    result = await call_backend(
-                        url,
-                        headers=headers,
-                        call_count=call_count,
-                        params=params,
-                        max_retry=max_retry
-                    )
+            if status in policy.retry_statuses:
+                logging.error(
+                    f'Retry request. Message: {message}. Status: {status}. Call Count: {retry.attempts}. Request ID: {request_id}. Correlation ID: {correlation_id}'
+                )
+                retry_after = parse_retry_after(attempt['headers'])
+                last_status, last_message = status, f'Server Error. status is {status}, message is {message}'
+                last_attempt = attempt
 
-                # Completed Orchestrator
-                elif status == 200:
-                    message = await response.text()
-                    logging.info(
-                        f'Scceeded to call backend. Message: {message}. Status: {status}. Call Count: {call_count}. Request ID: {request_id}. Correlation ID: {correlation_id}')
-                    result = {
-                        'backend_status': response.status,
-                        'backend_message': f'Succeeded to call backend. status is {status}, message is {message}',
-                    }
-                else:
-                    message = await response.text()
-                    logging.error(
-                        f'Failed to call backend. Message: {message}. Status: {status}. Call Count: {call_count}. Request ID: {request_id}. Correlation ID: {correlation_id}')
-                    result = {
-                        'status': response.status,
-                        'backend_message': f'Client Error. status is {status}, message is {message}',
-                    }
-    except ClientConnectionError as ce:
-        logging.exception(
-            f'Exception request: {ce}. Request ID: {request_id}. Correlation ID: {correlation_id}'
-        )
-        await asyncio.sleep(2 ** call_count)
-        call_count += 1
-        result = await polling_durable(
-            url,
-            headers=headers,
-            call_count=call_count,
-            params=params,
-            max_retry=max_retry
-        )
+            # Completed Orchestrator
+            elif status == 200:
+                logging.info(
+                    f'Scceeded to call backend. Message: {message}. Status: {status}. Call Count: {retry.attempts}. Request ID: {request_id}. Correlation ID: {correlation_id}')
+                result = {
+                    'backend_status': status,
+                    'backend_message': f'Succeeded to call backend. status is {status}, message is {message}',
+                }
+            else:
+                logging.error(
+                    f'Failed to call backend. Message: {message}. Status: {status}. Call Count: {retry.attempts}. Request ID: {request_id}. Correlation ID: {correlation_id}')
+                result = {
+                    'backend_status': status,
+                    'backend_message': f'Client Error. status is {status}, message is {message}',
+                }
 
-    except Exception as e:
-        logging.exception(
-            f'Exception on requesting current state: {e}. Request ID: {request_id}. Correlation ID: {correlation_id}')
-        raise
+            if status not in policy.retry_statuses:
+                if attempt['body'] is not None:
+                    result['backend_body'] = attempt['body']
+                    result['backend_headers'] = passthrough_headers(attempt['headers'])
+                return result
+        # A timed out attempt is retried like a 5xx, and counts as a failure once retries run out.
+        except policy.retry_exceptions as ce:
+            logging.exception(
+                f'Exception request: {ce!r}. Request ID: {request_id}. Correlation ID: {correlation_id}'
+            )
+            last_attempt = None
+            if isinstance(ce, asyncio.TimeoutError):
+                last_status, last_message = 504, 'Backend timed out'
+            else:
+                last_status, last_message = 502, f'Backend is unreachable {ce!r}'
 
-    return result
+        except Exception as e:
+            logging.exception(
+                f'Exception on requesting current state: {e}. Request ID: {request_id}. Correlation ID: {correlation_id}')
+            raise
+
+        delay = retry.next_delay(retry_after)
+        if delay is None:
+            result = {
+                'backend_status': last_status,
+                'backend_message': f'Reached max retry count {retry.attempts}. {last_message}',
+                'exhausted': True
+            }
+            if last_attempt is not None and last_attempt['body'] is not None:
+                result['backend_body'] = last_attempt['body']
+                result['backend_headers'] = passthrough_headers(last_attempt['headers'])
+            return result
+        await clock.sleep(delay)
@@ -0,0 +1,60 @@
+import calendar
+from datetime import datetime
+from typing import List, Optional
+
+
+def to_epoch(value: datetime) -> int:
+    """Convert a naive UTC datetime to integer epoch seconds."""
+    return calendar.timegm(value.utctimetuple())
+
+
+class FailureWindow:
+    """Sliding window failure counter kept as a fixed ring of buckets.
+
+    The window covers timespan_seconds split into buckets of equal width, so
+    adding a failure and reading the count are O(1) amortized and the
+    serialized size does not depend on the failure rate. Counts are exact to
+    the width of one bucket.
+    """
+
+    def __init__(self, timespan_seconds: int, buckets: int = 10) -> None:
+        self.size = max(int(buckets), 1)
+        self.bucket_seconds = max(-(-int(timespan_seconds) // self.size), 1)
+        self.counts: List[int] = [0] * self.size
+        self.head = 0
+        self.total = 0
+
+    def restore(self, bucket_seconds: int, head: int, counts: List[int]) -> None:
+        """Take stored counts, unless the bucket layout changed since they were stored."""
+        if bucket_seconds == self.bucket_seconds and len(counts) == self.size:
+            self.counts = list(counts)
+            self.head = head
+            self.total = sum(self.counts)
+
+    def advance(self, epoch: int) -> None:
+        index = epoch // self.bucket_seconds
+        if index <= self.head:
+            return
+        for i in range(1, min(index - self.head, self.size) + 1):
+            position = (self.head + i) % self.size
+            self.total -= self.counts[position]
+            self.counts[position] = 0
+        self.head = index
+
+    def add(self, epoch: int, count: int = 1) -> None:
+        index = epoch // self.bucket_seconds
+        self.advance(epoch)
+        if index <= self.head - self.size:
+            # Older than the window.
+            return
+        self.counts[index % self.size] += count
+        self.total += count
+
+    def count(self, epoch: Optional[int] = None) -> int:
+        if epoch is not None:
+            self.advance(epoch)
+        return self.total
+
+    def clear(self) -> None:
+        self.counts = [0] * self.size
+        self.total = 0
@@ -0,0 +1,282 @@
+"""Minimal in-process stand-ins for the Durable Functions runtime.
+
+Entities run one operation at a time per entity, and their state is kept as
+serialized JSON like the real task hub. Orchestrator generators are driven
+directly instead of being replayed, which is enough for the orchestrators in
+this repository since they only yield entity calls, task_all and timers.
+"""
+import asyncio
+import json
+import logging
+import types
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+import azure.functions as func
+import azure.durable_functions as df
+
+
+class EntityContext:
+    """Stand-in for DurableEntityContext."""
+
+    def __init__(self, name: str, key: str, operation_name: str, state: Optional[str], operation_input: Any) -> None:
+        self._name = name
+        self._key = key
+        self._operation_name = operation_name
+        self._state = state
+        self._input = operation_input
+        self._result = None
+        self._destructed = False
+
+    @property
+    def entity_name(self) -> str:
+        return self._name
+
+    @property
+    def entity_key(self) -> str:
+        return self._key
+
+    @property
+    def operation_name(self) -> str:
+        return self._operation_name
+
+    @property
+    def is_newly_constructed(self) -> bool:
+        return self._state is None
+
+    def get_state(self, initializer: Optional[Callable[[], Any]] = None) -> Any:
+        if self._state is None:
+            return initializer() if initializer is not None else None
+        return json.loads(self._state)
+
+    def set_state(self, state: Any) -> None:
+        self._state = json.dumps(state)
+
+    def get_input(self) -> Any:
+        return self._input
+
+    def set_result(self, result: Any) -> None:
+        self._result = result
+
+    def destruct_on_exit(self) -> None:
+        self._destructed = True
+
+
+class EntityCall:
+    def __init__(self, entity_id: Any, operation_name: str, operation_input: Any = None) -> None:
+        self.entity_id = entity_id
+        self.operation_name = operation_name
+        self.operation_input = operation_input
+
+
+class TaskAll:
+    def __init__(self, tasks: List[Any]) -> None:
+        self.tasks = tasks
+
+
+class Timer:
+    def __init__(self, fire_at: datetime) -> None:
+        self.fire_at = fire_at
+
+
+class OrchestrationContext:
+    """Stand-in for DurableOrchestrationContext."""
+
+    def __init__(self, instance_id: str, orchestration_input: Any) -> None:
+        self._instance_id = instance_id
+        self._input = orchestration_input
+
+    @property
+    def instance_id(self) -> str:
+        return self._instance_id
+
+    @property
+    def is_replaying(self) -> bool:
+        return False
+
+    @property
+    def current_utc_datetime(self) -> datetime:
+        return datetime.utcnow()
+
+    def get_input(self) -> Any:
+        return self._input
+
+    def call_entity(self, entityId: Any, operationName: str, operationInput: Any = None) -> EntityCall:
+        return EntityCall(entityId, operationName, operationInput)
+
+    def task_all(self, activities: List[Any]) -> TaskAll:
+        return TaskAll(activities)
+
+    def create_timer(self, fire_at: datetime) -> Timer:
+        return Timer(fire_at)
+
+
+class EntityStateResponse:
+    def __init__(self, entity_exists: bool, entity_state: Any = None) -> None:
+        self.entity_exists = entity_exists
+        self.entity_state = entity_state
+
+
+class DurableRuntime:
+    """Holds entities and orchestration instances of one task hub."""
+
+    def __init__(self, base_url: str, operation_latency_ms: float = 0) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.operation_latency_ms = operation_latency_ms
+        self.entity_functions: Dict[str, Callable] = {}
+        self.orchestrator_functions: Dict[str, Callable] = {}
+        self._states: Dict[tuple, str] = {}
+        self._locks: Dict[tuple, asyncio.Lock] = {}
+        self.instances: Dict[str, dict] = {}
+        self._finished: Dict[str, asyncio.Event] = {}
+
+    def status_url(self, instance_id: str) -> str:
+        return f'{self.base_url}/runtime/webhooks/durabletask/instances/{instance_id}'
+
+    async def call_entity(self, name: str, key: str, operation_name: str, operation_input: Any = None) -> Any:
+        entity_function = self.entity_functions[name]
+        lock = self._locks.setdefault((name, key), asyncio.Lock())
+        # Operations of one entity are processed serially.
+        async with lock:
+            if self.operation_latency_ms:
+                await asyncio.sleep(self.operation_latency_ms / 1000)
+            context = EntityContext(name, key, operation_name, self._states.get((name, key)), operation_input)
+            entity_function(context)
+            if context._destructed:
+                self._states.pop((name, key), None)
+            elif context._state is not None:
+                self._states[(name, key)] = context._state
+            return context._result
+
+    def signal_entity(self, name: str, key: str, operation_name: str, operation_input: Any = None) -> None:
+        task = asyncio.ensure_future(self.call_entity(name, key, operation_name, operation_input))
+        task.add_done_callback(self._log_failure)
+
+    def read_entity_state(self, name: str, key: str) -> EntityStateResponse:
+        state = self._states.get((name, key))
+        if state is None:
+            return EntityStateResponse(False)
+        return EntityStateResponse(True, json.loads(state))
+
+    def start_new(self, name: str, instance_id: Optional[str] = None, orchestration_input: Any = None) -> str:
+        instance_id = instance_id or uuid4().hex
+        existing = self.instances.get(instance_id)
+        if existing is not None and existing['runtimeStatus'] == 'Running':
+            # The task hub does not replace an instance that is still running.
+            raise ValueError(f'An orchestration with instance id {instance_id} is already running')
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.instances[instance_id] = {
+            'name': name,
+            'instanceId': instance_id,
+            'runtimeStatus': 'Running',
+            'input': orchestration_input,
+            'output': None,
+            'createdTime': now,
+            'lastUpdatedTime': now
+        }
+        self._finished[instance_id] = asyncio.Event()
+        task = asyncio.ensure_future(self._run_orchestration(name, instance_id, orchestration_input))
+        task.add_done_callback(self._log_failure)
+        return instance_id
+
+    def get_status(self, instance_id: str) -> Optional[dict]:
+        return self.instances.get(instance_id)
+
+    async def wait_for_completion(self, instance_id: str, timeout: float) -> Optional[dict]:
+        finished = self._finished.get(instance_id)
+        if finished is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(finished.wait()), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.instances.get(instance_id)
+
+    async def _run_orchestration(self, name: str, instance_id: str, orchestration_input: Any) -> None:
+        instance = self.instances[instance_id]
+        context = OrchestrationContext(instance_id, orchestration_input)
+        try:
+            output = self.orchestrator_functions[name](context)
+            if isinstance(output, types.GeneratorType):
+                output = await self._drive(output)
+            instance['runtimeStatus'] = 'Completed'
+            instance['output'] = output
+        except Exception as e:
+            logging.exception(f'Orchestration {instance_id} failed {e}')
+            instance['runtimeStatus'] = 'Failed'
+            instance['output'] = str(e)
+        instance['lastUpdatedTime'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        self._finished.pop(instance_id).set()
+
+    async def _drive(self, generator: types.GeneratorType) -> Any:
+        value = None
+        while True:
+            try:
+                task = generator.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value = await self._resolve(task)
+
+    async def _resolve(self, task: Any) -> Any:
+        if isinstance(task, EntityCall):
+            return await self.call_entity(
+                task.entity_id.name, task.entity_id.key, task.operation_name, task.operation_input)
+        elif isinstance(task, TaskAll):
+            return list(await asyncio.gather(*[self._resolve(t) for t in task.tasks]))
+        elif isinstance(task, Timer):
+            await asyncio.sleep(max((task.fire_at - datetime.utcnow()).total_seconds(), 0))
+            return None
+        raise TypeError(f'Unsupported orchestration task {task!r}')
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f'Durable operation failed {future.exception()}')
+
+
+class OrchestrationClient:
+    """Stand-in for DurableOrchestrationClient backed by DurableRuntime."""
+
+    def __init__(self, runtime: DurableRuntime) -> None:
+        self._runtime = runtime
+
+    async def start_new(self, orchestration_function_name: str, instance_id: Optional[str] = None, client_input: Any = None) -> str:
+        return self._runtime.start_new(orchestration_function_name, instance_id, client_input)
+
+    def create_check_status_response(self, request: func.HttpRequest, instance_id: str) -> func.HttpResponse:
+        status_url = self._runtime.status_url(instance_id)
+        return func.HttpResponse(
+            status_code=202,
+            body=json.dumps({'id': instance_id, 'statusQueryGetUri': status_url}),
+            headers={
+                'Content-Type': 'application/json',
+                'Location': status_url,
+                'Retry-After': '1'
+            }
+        )
+
+    async def wait_for_completion_or_create_check_status_response(
+            self, request: func.HttpRequest, instance_id: str,
+            timeout_in_milliseconds: int = 10000, retry_interval_in_milliseconds: int = 1000) -> func.HttpResponse:
+        instance = await self._runtime.wait_for_completion(instance_id, timeout_in_milliseconds / 1000)
+        if instance['runtimeStatus'] == 'Completed':
+            return func.HttpResponse(
+                status_code=200, body=json.dumps(instance['output']), mimetype='application/json')
+        elif instance['runtimeStatus'] == 'Failed':
+            return func.HttpResponse(
+                status_code=500, body=json.dumps(instance), mimetype='application/json')
+        return self.create_check_status_response(request, instance_id)
+
+    async def signal_entity(self, entityId: Any, operation_name: str, operation_input: Any = None) -> None:
+        self._runtime.signal_entity(entityId.name, entityId.key, operation_name, operation_input)
+
+    async def read_entity_state(self, entityId: Any) -> EntityStateResponse:
+        return self._runtime.read_entity_state(entityId.name, entityId.key)
+
+    async def get_status(self, instance_id: str) -> Any:
+        instance = self._runtime.get_status(instance_id)
+        return types.SimpleNamespace(
+            instance_id=instance_id,
+            runtime_status=df.OrchestrationRuntimeStatus(instance['runtimeStatus']) if instance else None,
+            output=instance['output'] if instance else None
+        )
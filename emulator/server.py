@@ -0,0 +1,144 @@
+"""Serve the circuit_breaker function app on top of the in-process runtime.
+
+    python -m emulator.server --port 7072
+
+Functions are discovered from function.json like the Functions host does.
+Entity and orchestrator functions are registered by folder name, and HTTP
+functions with an orchestrationClient binding are served on /api/<route>
+through their run(req, client) coroutine. Other HTTP functions, such as
+metrics, are served through main(req). The Durable HTTP API routes used
+in test.http are served under /runtime/webhooks/durabletask.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+
+import azure.functions as func
+from aiohttp import web
+
+from .durable import DurableRuntime, OrchestrationClient
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CIRCUIT_BREAKER_DIR = os.path.join(ROOT, 'circuit_breaker')
+
+
+def http_handler(run, client: OrchestrationClient):
+    async def handle(request: web.Request) -> web.Response:
+        req = func.HttpRequest(
+            method=request.method,
+            url=str(request.url),
+            headers=dict(request.headers),
+            params=dict(request.query),
+            route_params=dict(request.match_info),
+            body=await request.read()
+        )
+        resp = await run(req, client)
+        headers = dict(resp.headers)
+        if not any(name.lower() == 'content-type' for name in headers):
+            headers['Content-Type'] = resp.mimetype
+        return web.Response(
+            status=resp.status_code,
+            body=resp.get_body(),
+            headers=headers
+        )
+    return handle
+
+
+def load_function_app(app_dir: str, runtime: DurableRuntime, app: web.Application) -> None:
+    sys.path.insert(0, app_dir)
+    client = OrchestrationClient(runtime)
+    for name in sorted(os.listdir(app_dir)):
+        path = os.path.join(app_dir, name, 'function.json')
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            bindings = json.load(f)['bindings']
+        types = {binding['type'] for binding in bindings}
+        module = importlib.import_module(name)
+
+        if 'entityTrigger' in types:
+            runtime.entity_functions[name] = module.entity_function
+        elif 'orchestrationTrigger' in types:
+            runtime.orchestrator_functions[name] = module.orchestrator_function
+        elif 'httpTrigger' in types and 'orchestrationClient' in types:
+            trigger = next(b for b in bindings if b['type'] == 'httpTrigger')
+            for method in trigger.get('methods', ['get', 'post']):
+                app.router.add_route(
+                    method.upper(), f'/api/{trigger.get("route", name)}', http_handler(module.run, client))
+        elif 'httpTrigger' in types:
+            trigger = next(b for b in bindings if b['type'] == 'httpTrigger')
+            run = (lambda main: lambda req, client: main(req))(module.main)
+            for method in trigger.get('methods', ['get', 'post']):
+                app.router.add_route(
+                    method.upper(), f'/api/{trigger.get("route", name)}', http_handler(run, client))
+        else:
+            continue
+        logging.info(f'Loaded function {name}')
+
+
+def create_app(base_url: str, operation_latency_ms: float = 0) -> web.Application:
+    runtime = DurableRuntime(base_url, operation_latency_ms)
+    app = web.Application()
+    app['runtime'] = runtime
+
+    async def entity(request: web.Request) -> web.Response:
+        name, key = request.match_info['name'], request.match_info['key']
+        if request.method == 'GET':
+            response = runtime.read_entity_state(name, key)
+            if not response.entity_exists:
+                return web.Response(status=404)
+            return web.json_response(response.entity_state)
+
+        body = await request.read()
+        runtime.signal_entity(name, key, request.query['op'], json.loads(body) if body else None)
+        return web.Response(status=202)
+
+    async def instance(request: web.Request) -> web.Response:
+        status = runtime.get_status(request.match_info['instanceId'])
+        if status is None:
+            return web.Response(status=404)
+        if status['runtimeStatus'] in ('Running', 'Pending'):
+            return web.json_response(
+                status, status=202, headers={'Location': str(request.url), 'Retry-After': '1'})
+        return web.json_response(status)
+
+    async def start(request: web.Request) -> web.Response:
+        body = await request.read()
+        try:
+            instance_id = runtime.start_new(
+                request.match_info['functionName'], request.match_info.get('instanceId'), json.loads(body) if body else None)
+        except ValueError as e:
+            return web.Response(status=409, text=str(e))
+        status_url = runtime.status_url(instance_id)
+        return web.json_response(
+            {'id': instance_id, 'statusQueryGetUri': status_url}, status=202, headers={'Location': status_url})
+
+    webhooks = '/runtime/webhooks/durabletask'
+    app.router.add_route('*', webhooks + '/entities/{name}/{key}', entity)
+    app.router.add_get(webhooks + '/instances/{instanceId}', instance)
+    app.router.add_post(webhooks + '/orchestrators/{functionName}', start)
+    app.router.add_post(webhooks + '/orchestrators/{functionName}/{instanceId}', start)
+
+    load_function_app(CIRCUIT_BREAKER_DIR, runtime, app)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run the circuit_breaker function app without the Functions host.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7072)
+    parser.add_argument('--operation-latency-ms', type=float, default=0,
+                        help='delay added to every entity operation to mimic task hub storage')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(f'http://{args.host}:{args.port}', args.operation_latency_ms)
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main()